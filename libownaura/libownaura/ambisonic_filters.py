@@ -0,0 +1,151 @@
+"""Factorize lora filters into Ambisonic-domain filters and a static decoder.
+
+Lora builds its filters from an Ambisonic representation that is decoded to
+the loudspeakers. The 64 filters are therefore close to a linear combination of
+few filters. This module finds that low-rank structure
+
+    w = D a
+
+with `a` holding `(N + 1)**2` filters for Ambisonic order `N` and `D` a static
+(nout, (N + 1)**2) decoding matrix. Rendering then convolves only the filters
+in `a` and applies `D` to each output block, which cuts the convolution cost by
+`nout / (N + 1)**2`.
+
+The factorization is a truncated singular value decomposition of the filter
+bank, which is the best fit in the least squares sense. As Lora reproduces
+the early reflections with single loudspeakers, the fit is not exact and the
+error is reported per loudspeaker.
+
+Example
+-------
+Factorize the calibrated filters of a room for third order and render with it
+
+    python -m libownaura.ambisonic_filters "Room 1_calibrated.wav" -N 3
+    python -m libownaura.convolver "Room 1_calibrated_ambisonic.npz" recording.wav
+
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from libownaura.convolver import UniformPartitionedConvolver
+
+
+def factorize_filters(w, nch):
+    """Fit filter bank w with nch filters and a decoding matrix.
+
+    Parameters
+    ----------
+    w : ndarray, shape (nout, nsample)
+        Filter bank.
+    nch : int
+        Number of filters in the factorization, `(N + 1)**2` for order `N`.
+
+    Returns
+    -------
+    D : ndarray, shape (nout, nch)
+        Decoding matrix with orthonormal columns.
+    a : ndarray, shape (nch, nsample)
+        Filters.
+
+    """
+    # left singular vectors of w from the small (nout, nout) gram matrix
+    eigvals, U = np.linalg.eigh(w @ w.T)
+    D = U[:, np.argsort(eigvals)[::-1][:nch]]
+    a = D.T @ w
+    return D, a
+
+
+def factorization_error(w, D, a):
+    """Relative error energy of the factorization in dB per filter and in total."""
+    residual = np.sum((w - D @ a)**2, axis=-1)
+    energy = np.sum(w**2, axis=-1)
+    return 10 * np.log10(residual / energy), 10 * np.log10(residual.sum() / energy.sum())
+
+
+def save_factorization(filename, D, a, fs, error_dB):
+    np.savez(filename, D=D, a=a, fs=fs, error_dB=error_dB,
+             docs="D: decoding matrix (nout, nch), a: filters (nch, nsample), fs: samplerate, error_dB: relative error per output")
+
+
+def load_factorization(filename):
+    with np.load(filename) as data:
+        return data['D'], data['a'], int(data['fs'])
+
+
+class AmbisonicRenderer:
+    """Convolve in the Ambisonic domain and decode to the loudspeakers.
+
+    Has the same interface as `UniformPartitionedConvolver`, but convolves only
+    the `nch` filters of the factorization.
+
+    Parameters
+    ----------
+    D : ndarray, shape (nout, nch)
+        Decoding matrix.
+    a : ndarray, shape (nch, nsample)
+        Filters.
+    blocksize : int
+        Block size of the partitioned convolution.
+
+    """
+
+    def __init__(self, D, a, blocksize, dtype=np.complex64):
+        self.convolver = UniformPartitionedConvolver.from_filters(a, blocksize, dtype=dtype)
+        self.D = D.astype(self.convolver.frame.dtype)
+        self.blocksize = blocksize
+        self.nout = D.shape[0]
+        self.nsample = a.shape[1]
+
+    @classmethod
+    def from_file(cls, filename, blocksize, dtype=np.complex64):
+        """Create renderer from a factorization saved with `save_factorization`."""
+        D, a, _ = load_factorization(filename)
+        return cls(D, a, blocksize, dtype=dtype)
+
+    def reset(self):
+        self.convolver.reset()
+
+    def process_block(self, x):
+        return self.D @ self.convolver.process_block(x)
+
+    def input_spectra(self, x):
+        return self.convolver.input_spectra(x)
+
+    def render(self, x):
+        return self.D @ self.convolver.render(x)
+
+    def render_chunks(self, X, npad=None):
+        for y in self.convolver.render_chunks(X, npad=npad):
+            yield self.D @ y
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Factorize lora filters into Ambisonic-domain filters and a decoding matrix',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('lora_filter', help='(calibrated) lora filter wav file', type=Path)
+    parser.add_argument('-N', '--order', help='Ambisonic order, uses (N + 1)**2 filters', default=3, type=int)
+    parser.add_argument('-o', '--output', help='output file path. Default: lora filter name with `_ambisonic.npz` appended', type=Path, default=None)
+
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = args.lora_filter.with_name(args.lora_filter.stem + '_ambisonic.npz')
+
+    w, fs = sf.read(args.lora_filter)
+    w = w.T  # shape (nch, nsample)
+
+    nch = (args.order + 1)**2
+    D, a = factorize_filters(w, nch)
+    error_dB, total_error_dB = factorization_error(w, D, a)
+
+    print(f"Order {args.order}: {nch} filters instead of {w.shape[0]}, {w.shape[0] / nch:.1f}x fewer convolutions.")
+    print(f"Relative error: {total_error_dB:.1f} dB in total, {error_dB.max():.1f} dB at worst (loudspeaker {error_dB.argmax() + 1}).")
+
+    save_factorization(args.output, D, a, fs, error_dB)
+    print(f"Created {args.output}")
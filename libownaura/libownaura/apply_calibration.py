@@ -5,48 +5,119 @@ import re
 from pathlib import Path
 
 import numpy as np
+import scipy.fft
 import matplotlib.pyplot as plt
 import soundfile as sf
 from response import Response
 
+from libownaura.streaming import OverlapAddFilter
+
 
 def apply_calibration(w, h, n):
     """Convonve each filter in w with h and cut or pad by n samples.
 
+    All channels are convolved at once in the frequency domain. The cut or pad
+    is applied in the same pass as a circular shift of the spectrum of h.
+
     Args:
         w (ndarray[nch, nsample]): multichan impulse response
         h (1d ndarray): calibration impulse response
         n: cut or pad with this amount of samples
     """
-    # calibrate filter gain with minimum_phase_filter
-    w_cal = np.zeros((w.shape[0], h.shape[0] + w.shape[1] - 1))
-    for i in range(w.shape[0]):
-        w_cal[i] = np.convolve(w[i], h)
+    n = int(n)
+    nconv = w.shape[1] + h.shape[0] - 1
+    nout = nconv - n
+    nfft = scipy.fft.next_fast_len(max(nconv, nout), real=True)
+
+    # calibrate filter gain with minimum_phase_filter and filter time with a
+    # circular shift by n samples. Cut samples end up at the end of the frame.
+    H = scipy.fft.rfft(h, n=nfft)
+    H *= np.exp(2j * np.pi * n / nfft * np.arange(H.shape[0]))
+    W = scipy.fft.rfft(w, n=nfft, axis=-1)
+    W *= H
+    w_cal = scipy.fft.irfft(W, n=nfft, axis=-1)
+    del W
 
-    # calibrate filter time
     if n > 0:  # cut samples at beginning
-        w_cut = w_cal[:, :n]
-        print(f"Cutting {np.sum(w_cut**2) / np.sum(w_cal**2) * 100:.5f}% of energy in filter.")
-        w_cal = w_cal[:, n:]
-    elif n < 0: # pad at the beginning
-        w_cal = np.pad(w_cal, ((0, 0), (-n, 0)))
+        w_cut = w_cal[:, nfft - n:]
+        energy_cut = np.sum(w_cut**2)
+        print(f"Cutting {energy_cut / (energy_cut + np.sum(w_cal[:, :nout]**2)) * 100:.5f}% of energy in filter.")
 
     # NOTE: one could apply a quick fade in here
 
-    return w_cal
+    return w_cal[:, :nout]
 
 
-def main(lora_filter, calibration_file, outfile, debug):
-     # load lora wav file
-    w, fs = sf.read(lora_filter)
-    w = w.T  # shape (nch, nsample)
+def apply_calibration_streaming(lora_filter, outfile, h, n, blocksize):
+    """Calibrate a lora wav file block by block and write it to outfile.
 
-    # load calibration file
+    Gives the same result as `apply_calibration` on the whole file, but only a
+    few blocks of the filters are held in memory at any time.
+
+    Args:
+        lora_filter: wav export from lora toolbox
+        outfile: path of calibrated output file
+        h (1d ndarray): calibration impulse response
+        n: cut or pad with this amount of samples
+        blocksize: number of samples read, filtered and written at once
+    """
+    n = int(n)
+    info = sf.info(lora_filter)
+    ola = OverlapAddFilter(h, blocksize, nch=info.channels)
+
+    ncut = max(n, 0)
+    energy_cut = 0
+    energy_total = 0
+
+    # NOTE: subtype here is important, without, there are audible artifacts in the responses, presumbably due to the small values
+    with sf.SoundFile(outfile, 'w', samplerate=info.samplerate, channels=info.channels, subtype='FLOAT') as out:
+        # pad at the beginning
+        for start in range(0, max(-n, 0), blocksize):
+            out.write(np.zeros((min(blocksize, -n - start), info.channels)))
+
+        blocks = sf.blocks(lora_filter, blocksize=blocksize, always_2d=True)
+        for w_cal in ola.process_blocks(w.T for w in blocks):
+            energy_total += np.sum(w_cal**2)
+
+            # cut samples at beginning
+            if ncut > 0:
+                w_cut = w_cal[:, :ncut]
+                energy_cut += np.sum(w_cut**2)
+                w_cal = w_cal[:, ncut:]
+                ncut -= w_cut.shape[1]
+
+            out.write(w_cal.T)
+
+    if n > 0:
+        print(f"Cutting {energy_cut / energy_total * 100:.5f}% of energy in filter.")
+
+
+def load_calibration_file(calibration_file, fs):
+    """Load calibration impulse response h and the samples n to cut or pad."""
     with np.load(calibration_file) as data:
         assert data['fs'] == fs, f"impulse response (fs={fs}) and calibration file (fs={data['fs']}) must have same samplerate"
         h = data['h']
         n = data['n']
 
+    return h, n
+
+
+def main(lora_filter, calibration_file, outfile, debug, blocksize=None):
+    if blocksize is not None:
+        if debug:
+            print("Debug plots are not available when streaming.")
+        h, n = load_calibration_file(calibration_file, sf.info(lora_filter).samplerate)
+        apply_calibration_streaming(lora_filter, outfile, h, n, blocksize)
+        print(f"Saved calibrated filter at `{outfile}`.")
+        return
+
+     # load lora wav file
+    w, fs = sf.read(lora_filter)
+    w = w.T  # shape (nch, nsample)
+
+    # load calibration file
+    h, n = load_calibration_file(calibration_file, fs)
+
     w_cal = apply_calibration(w, h, n)
 
     if debug:
@@ -107,6 +178,7 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', help='path or name of output file')
     #parser.add_argument('--window', help='a time window to be applied to all filters', default=((0, 0.0001), ((3.5, 3.8))), type=my_regex_window_type)
     parser.add_argument('-d', '--debug', help='turn on debug plotting', action='store_true')
+    parser.add_argument('-b', '--blocksize', help='stream the filters in blocks of this many samples to bound memory use', default=None, type=int)
 
     # parse args
     args = parser.parse_args()
@@ -118,4 +190,4 @@ if __name__ == '__main__':
         lora_filter_path = Path(args.lora_filter)
         outfile_str = str(lora_filter_path.parent / lora_filter_path.stem) + "_calibrated.wav"
 
-    main(args.lora_filter, args.calibration_file, outfile_str, DEBUG)
\ No newline at end of file
+    main(args.lora_filter, args.calibration_file, outfile_str, DEBUG, blocksize=args.blocksize)
\ No newline at end of file
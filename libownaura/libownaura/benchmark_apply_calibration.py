@@ -0,0 +1,70 @@
+"""Compare the frequency domain calibration with the former per-channel loop."""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from libownaura.apply_calibration import apply_calibration
+
+
+def apply_calibration_loop(w, h, n):
+    """Reference implementation convolving each channel with `np.convolve`."""
+    w_cal = np.zeros((w.shape[0], h.shape[0] + w.shape[1] - 1))
+    for i in range(w.shape[0]):
+        w_cal[i] = np.convolve(w[i], h)
+
+    if n > 0:
+        w_cal = w_cal[:, n:]
+    elif n < 0:
+        w_cal = np.pad(w_cal, ((0, 0), (-n, 0)))
+
+    return w_cal
+
+
+def synthetic_lora_filters(nch, T, fs, T60=1.0, seed=0):
+    """Exponentially decaying noise as a stand-in for a lora filter bank."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(T * fs)) / fs
+    return rng.standard_normal((nch, t.size)) * 10 ** (-3 * t / T60)
+
+
+def timeit(func, *args, repeat=1):
+    """Return minimum run time in seconds and the result of the last call."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark calibration of a synthetic lora filter bank',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-T', '--durations', help='filter lengths in seconds', nargs='+', default=[1, 2, 3, 4, 5], type=float)
+    parser.add_argument('-N', '--nch', help='number of channels', default=64, type=int)
+    parser.add_argument('-M', '--filter-length', help='length of calibration filter', default=511, type=int)
+    parser.add_argument('-n', '--cut', help='samples to cut (positive) or pad (negative)', default=100, type=int)
+    parser.add_argument('-r', '--repeat', help='repetitions of the fft variant, report minimum', default=3, type=int)
+    parser.add_argument('--skip-loop', help='do not run the slow reference loop', action='store_true')
+
+    args = parser.parse_args()
+
+    fs = 48000
+    h = np.random.default_rng(1).standard_normal(args.filter_length) / args.filter_length
+
+    print(f"{'T [s]':>6} {'loop [s]':>10} {'fft [s]':>10} {'speedup':>8} {'max error':>10}")
+    for T in args.durations:
+        w = synthetic_lora_filters(args.nch, T, fs)
+        t_fft, w_fft = timeit(apply_calibration, w, h, args.cut, repeat=args.repeat)
+        if args.skip_loop:
+            print(f"{T:6.1f} {'-':>10} {t_fft:10.3f} {'-':>8} {'-':>10}")
+            continue
+        t_loop, w_loop = timeit(apply_calibration_loop, w, h, args.cut)
+        print(f"{T:6.1f} {t_loop:10.3f} {t_fft:10.3f} {t_loop / t_fft:8.1f} {np.abs(w_loop - w_fft).max():10.2e}")
@@ -0,0 +1,156 @@
+"""Benchmark the real-time performance of the partitioned convolution.
+
+The Python counterpart of `MAX/compare multi and single core convolution.maxpat`.
+Synthetic 64-channel filter banks of several lengths are convolved block by
+block with `libownaura.convolver` for several block sizes. For each setting the
+real-time factor (processing time over audio time), the mean and the worst
+time per block are measured. With more than one worker, the loudspeaker
+channels are split between worker processes like in
+`MAX/multicore_multiconvolve.maxpat`.
+
+Results are saved as JSON together with some information about the machine,
+such that machines can be compared before an experiment.
+
+Example
+-------
+    python -m libownaura.benchmark_convolution -T 0.5 1 2 5 -b 32 256 2048 -w 1 2 4
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+
+from libownaura.benchmark_apply_calibration import synthetic_lora_filters
+from libownaura.convolver import (BLOCKSIZES, NonUniformPartitionedConvolver, UniformPartitionedConvolver,
+                                  plan_partitions)
+
+ENGINES = ('uniform', 'nonuniform')
+
+
+def make_convolver(w, blocksize, engine):
+    if engine == 'uniform':
+        return UniformPartitionedConvolver.from_filters(w, blocksize)
+    layout, _ = plan_partitions(w.shape[1], blocksize, nout=w.shape[0])
+    return NonUniformPartitionedConvolver(w, layout)
+
+
+def time_blocks(nch, T, fs, blocksize, engine, nblocks, seed=0):
+    """Time the processing of nblocks blocks of noise.
+
+    For the non-uniform engine, at least as many blocks are timed as needed
+    to run the largest segment once, which gives the worst case.
+
+    Returns
+    -------
+    setup_time : float
+        Time to compute the filter spectra in seconds.
+    block_times : ndarray, shape (nblocks,)
+        Processing time of each block in seconds.
+
+    """
+    w = synthetic_lora_filters(nch, T, fs, seed=seed).astype(np.float32)
+
+    start = time.perf_counter()
+    convolver = make_convolver(w, blocksize, engine)
+    setup_time = time.perf_counter() - start
+
+    if engine == 'nonuniform':
+        nblocks = max(nblocks, max(b for b, _ in convolver.layout) // blocksize)
+
+    x = np.random.default_rng(seed).standard_normal((nblocks, blocksize)).astype(np.float32)
+    block_times = np.empty(nblocks)
+    for i in range(nblocks):
+        start = time.perf_counter()
+        convolver.process_block(x[i])
+        block_times[i] = time.perf_counter() - start
+
+    return setup_time, block_times
+
+
+def _time_blocks(args):
+    return time_blocks(*args)
+
+
+def benchmark(T, blocksize, engine, nworkers, nblocks, nch=64, fs=48000):
+    """Benchmark one setting, splitting the channels between nworkers processes."""
+    jobs = [
+        (len(channels), T, fs, blocksize, engine, nblocks, seed)
+        for seed, channels in enumerate(np.array_split(np.arange(nch), nworkers))
+    ]
+    if nworkers == 1:
+        results = [_time_blocks(jobs[0])]
+    else:
+        with Pool(nworkers) as pool:
+            results = pool.map(_time_blocks, jobs)
+
+    setup_times, block_times = zip(*results)
+    nblocks = min(len(t) for t in block_times)
+    block_times = np.stack([t[:nblocks] for t in block_times])  # shape (nworkers, nblocks)
+
+    # workers run in parallel, a block is done when the slowest worker is done
+    block_budget = blocksize / fs
+    return {
+        'filter_length_s': T,
+        'blocksize': blocksize,
+        'engine': engine,
+        'workers': nworkers,
+        'nch': nch,
+        'fs': fs,
+        'nblocks': nblocks,
+        'setup_time_s': max(setup_times),
+        'real_time_factor': block_times.sum(axis=-1).max() / (nblocks * block_budget),
+        'block_budget_ms': block_budget * 1e3,
+        'block_time_mean_ms': block_times.max(axis=0).mean() * 1e3,
+        'block_time_max_ms': block_times.max() * 1e3,
+    }
+
+
+def machine_info():
+    return {
+        'hostname': socket.gethostname(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark real-time partitioned convolution of synthetic lora filters',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-T', '--filter-lengths', help='filter lengths in seconds', nargs='+', default=[0.5, 1, 2, 5], type=float)
+    parser.add_argument('-b', '--blocksizes', help='block sizes', nargs='+', default=list(BLOCKSIZES), type=int, choices=BLOCKSIZES)
+    parser.add_argument('-w', '--workers', help='numbers of worker processes', nargs='+', default=[1], type=int)
+    parser.add_argument('-e', '--engines', help='convolution engines', nargs='+', default=list(ENGINES), choices=ENGINES)
+    parser.add_argument('-n', '--nblocks', help='number of blocks to time per setting', default=200, type=int)
+    parser.add_argument('-N', '--nch', help='number of loudspeaker channels', default=64, type=int)
+    parser.add_argument('-o', '--output', help='output json file', default='benchmark_convolution_' + socket.gethostname() + '.json')
+
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'T [s]':>6} {'block':>6} {'engine':>10} {'workers':>7} {'RTF':>7} {'mean [ms]':>10} {'max [ms]':>9} {'budget [ms]':>11}")
+    for T in args.filter_lengths:
+        for blocksize in args.blocksizes:
+            for engine in args.engines:
+                for nworkers in args.workers:
+                    r = benchmark(T, blocksize, engine, nworkers, args.nblocks, nch=args.nch)
+                    results.append(r)
+                    print(f"{T:6.1f} {blocksize:6d} {engine:>10} {nworkers:7d} {r['real_time_factor']:7.3f} "
+                          f"{r['block_time_mean_ms']:10.3f} {r['block_time_max_ms']:9.3f} {r['block_budget_ms']:11.3f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+    print(f"Saved results to {args.output}")
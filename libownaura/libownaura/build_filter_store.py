@@ -0,0 +1,116 @@
+"""Precompute the partition spectra of calibrated lora filters for fast loading.
+
+For each room, the spectra of the filter partitions are written as a complex64
+`.npy` file in the layout used by `UniformPartitionedConvolver`, next to a
+small `.json` header with block size, samplerate and channel count. Loading a
+room then maps the `.npy` file into memory instead of reading and transforming
+seconds of 64-channel audio.
+
+Example
+-------
+Build the store for all calibrated filters in the current folder
+
+    python -m libownaura.build_filter_store -b 1024 -o filter_store
+
+"""
+
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from libownaura.convolver import BLOCKSIZES, UniformPartitionedConvolver, partition_filters
+
+
+def store_paths(store_folder, name, blocksize):
+    """Paths of spectra and header file of a room in the store."""
+    stem = f"{name}_B{blocksize}"
+    return store_folder / (stem + '.npy'), store_folder / (stem + '.json')
+
+
+def build_filter_store(lora_filter, store_folder, blocksize):
+    """Write the partition spectra and header of one lora filter wav file.
+
+    Returns
+    -------
+    Path
+        Path of the header file.
+
+    """
+    lora_filter = Path(lora_filter)
+    w, fs = sf.read(str(lora_filter), dtype=np.float32)
+    w = w.T  # shape (nch, nsample)
+
+    W = partition_filters(w, blocksize, dtype=np.complex64)
+
+    spectra_file, header_file = store_paths(store_folder, lora_filter.stem, blocksize)
+    np.save(spectra_file, W)
+    header = {
+        'blocksize': blocksize,
+        'fs': fs,
+        'nch': w.shape[0],
+        'nsample': w.shape[1],
+        'spectra': spectra_file.name,
+        'source': lora_filter.name,
+    }
+    with open(header_file, 'w') as f:
+        json.dump(header, f, indent=2)
+
+    return header_file
+
+
+def load_filter_store(header_file):
+    """Map the partition spectra of a room into memory without copying.
+
+    Parameters
+    ----------
+    header_file : str or Path
+        Header written by `build_filter_store`.
+
+    Returns
+    -------
+    header : dict
+        Block size, samplerate `fs`, channel count `nch` and filter length
+        `nsample`.
+    W : numpy.memmap, shape (blocksize + 1, npart, nch)
+        Read-only partition spectra.
+
+    """
+    header_file = Path(header_file)
+    with open(header_file) as f:
+        header = json.load(f)
+
+    W = np.load(header_file.parent / header['spectra'], mmap_mode='r')
+    assert W.shape[0] == header['blocksize'] + 1 and W.shape[2] == header['nch'], f"{header['spectra']} does not match its header"
+
+    return header, W
+
+
+def convolver_from_store(header_file):
+    """Create a `UniformPartitionedConvolver` on the memory-mapped spectra of a room."""
+    header, W = load_filter_store(header_file)
+    return UniformPartitionedConvolver(W, header['blocksize'], nsample=header['nsample'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Precompute partition spectra of calibrated lora filters',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-l', '--lora_filter_folder', help='the folder holding the calibrated lora filters', default='.', type=Path)
+    parser.add_argument('-g', '--glob', help='pattern of lora filter files in the folder', default='*_calibrated.wav')
+    parser.add_argument('-o', '--output_folder', help='folder of the filter store', default='filter_store', type=Path)
+    parser.add_argument('-b', '--blocksize', help='block size of the partitioned convolution', default=1024, type=int, choices=BLOCKSIZES)
+
+    args = parser.parse_args()
+
+    lora_filters = sorted(args.lora_filter_folder.glob(args.glob))
+    if not lora_filters:
+        raise Exception(f'Could not find any lora filters matching {args.glob} in {args.lora_filter_folder}. Check path!')
+
+    args.output_folder.mkdir(parents=True, exist_ok=True)
+    for lora_filter in lora_filters:
+        header_file = build_filter_store(lora_filter, args.output_folder, args.blocksize)
+        print(f"Created {header_file}")
@@ -0,0 +1,122 @@
+"""Content-addressed on-disk cache of intermediate results of the calibration.
+
+Each result is stored as a `.npy` file named by the sha256 of the stage name,
+the content hashes of the input files and the parameters. Changing an input
+file or a parameter therefore gives a new entry instead of a stale result.
+Reading an entry marks it as recently used, and the least recently used
+entries are deleted when the cache grows beyond its maximum size.
+
+Example
+-------
+    cache = Cache()
+    h = cached(cache, 'h_direct_avil', lambda: compute_H_direct_avil(f, reg), files=[f], reg=reg)
+
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+import libownaura.utils as utils
+
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'ownaura'
+DEFAULT_MAX_BYTES = 2**30
+
+
+class Cache:
+    """Folder of cached results with size based least recently used eviction.
+
+    Parameters
+    ----------
+    folder : str or Path, optional
+        Cache folder, created if missing.
+    max_bytes : int, optional
+        Maximum total size of the cached results.
+
+    """
+
+    def __init__(self, folder=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def key(self, stage, files=(), **params):
+        """Key of a stage result from its input files and parameters."""
+        description = {
+            'stage': stage,
+            'files': [utils.file_hash(f) for f in files],
+            'params': params,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, key):
+        return self.folder / (key + '.npy')
+
+    def load(self, key):
+        """Return cached array or None if not in cache."""
+        path = self.path(key)
+        try:
+            value = np.load(path)
+        except FileNotFoundError:
+            return None
+
+        # mark as recently used
+        os.utime(path)
+        return value
+
+    def save(self, key, value):
+        path = self.path(key)
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, value)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used results until the cache fits into max_bytes."""
+        entries = sorted((p.stat().st_mtime, p.stat().st_size, p) for p in self.folder.glob('*.npy'))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+def cached(cache, stage, func, files=(), **params):
+    """Return result of func() for a stage, computing it only if not cached.
+
+    Parameters
+    ----------
+    cache : Cache or None
+        Cache to use. If None, func is always called.
+    stage : str
+        Name of the stage.
+    func : callable
+        Computes the result as ndarray without arguments.
+    files : list of str or Path, optional
+        Input files of the stage, keyed by their content.
+    **params
+        Parameters of the stage, must be JSON serializable.
+
+    Returns
+    -------
+    numpy.ndarray
+        Result of func().
+
+    """
+    if cache is None:
+        return func()
+
+    key = cache.key(stage, files, **params)
+    value = cache.load(key)
+    if value is None:
+        value = func()
+        cache.save(key, value)
+    else:
+        print(f"Using cached {stage}")
+
+    return value
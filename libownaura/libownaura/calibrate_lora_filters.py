@@ -1,9 +1,34 @@
 import os
+import json
 import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from libownaura.apply_calibration import main as apply_calibration
+from libownaura.utils import file_hash
 
 OWNAURA_PATH = Path(os.path.realpath(__file__)).parent.parent.parent
+MANIFEST_NAME = "calibration_manifest.json"
+
+
+def load_manifest(output_folder):
+    """Load input hashes of previously calibrated filters in output_folder."""
+    manifest_file = output_folder / MANIFEST_NAME
+    if not manifest_file.is_file():
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(output_folder, manifest):
+    with open(output_folder / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def calibrate(lora_filter, calibration_file, outfile, debug, blocksize):
+    print('Calibrating', lora_filter)
+    apply_calibration(str(lora_filter), calibration_file, outfile, debug, blocksize=blocksize)
+    return outfile
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -30,6 +55,16 @@ if __name__ == '__main__':
     parser.add_argument(
         "--debug", action="store_true", help="turn on debug plotting", default=False
     )
+    parser.add_argument(
+        "-j", "--workers", help="number of worker processes. Debug plotting always runs in one process.", default=1, type=int
+    )
+    parser.add_argument(
+        "-i", "--incremental", action="store_true", default=False,
+        help=f"skip filters whose input filter and calibration file did not change since the last run (tracked in {MANIFEST_NAME} in the output folder)"
+    )
+    parser.add_argument(
+        "-b", "--blocksize", help="stream the filters in blocks of this many samples to bound memory use", default=None, type=int
+    )
 
     args = parser.parse_args()
 
@@ -42,7 +77,33 @@ if __name__ == '__main__':
     if not lora_filters:
         raise Exception(f'Could not find any lora filters in {args.lora_filter_folder}. Check path!')
 
+    manifest = load_manifest(args.output_folder)
+    calibration_hash = file_hash(args.calibration_file)
+
+    jobs = {}
     for lora_filter in lora_filters:
         outfile = str(args.output_folder / (lora_filter.stem + "_calibrated.wav"))
-        print('Calibrating', lora_filter)
-        apply_calibration(str(lora_filter), args.calibration_file, outfile, args.debug)
\ No newline at end of file
+        hashes = {"lora_filter": file_hash(lora_filter), "calibration_file": calibration_hash}
+        if args.incremental and Path(outfile).is_file() and manifest.get(Path(outfile).name) == hashes:
+            print('Up to date', outfile)
+            continue
+        jobs[outfile] = (lora_filter, hashes)
+
+    def record(outfile):
+        manifest[Path(outfile).name] = jobs[outfile][1]
+        save_manifest(args.output_folder, manifest)
+
+    workers = 1 if args.debug else args.workers
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(calibrate, lora_filter, args.calibration_file, outfile, args.debug, args.blocksize)
+                for outfile, (lora_filter, _) in jobs.items()
+            ]
+            for future in as_completed(futures):
+                record(future.result())
+    else:
+        for outfile, (lora_filter, _) in jobs.items():
+            record(calibrate(lora_filter, args.calibration_file, outfile, args.debug, args.blocksize))
+
+    print(f'Calibrated {len(jobs)} of {len(lora_filters)} lora filters.')
\ No newline at end of file
@@ -10,16 +10,19 @@ which is equivalent to
 
 import os
 import argparse
+import functools
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import scipy
+import scipy.fft
 import scipy.signal
 import soundfile as sf
 
 import libownaura.utils as utils
+from libownaura.cache import DEFAULT_CACHE_DIR, Cache, cached
+from libownaura.streaming import WelchEstimator
 
 import response
 from response import Response
@@ -29,6 +32,12 @@ fs = 48000
 OWNAURA_PATH = Path(os.path.realpath(__file__)).parent.parent.parent
 DEBUG = False
 
+# octave bands of calibration filter, 32 and 16000 are only used to get the band edges
+BAND_CENTER_FREQS = [32, 63, 125, 250, 500, 1000, 2000, 4000, 8000, 16000]
+
+# longest filter in search of the filter length
+MAX_FILTER_LENGTH = 4095
+
 def wiener_filter(x, y, n, reg=0, constrained=False):
     """Compute optimal wiener filter.
 
@@ -54,17 +63,44 @@ def wiener_filter(x, y, n, reg=0, constrained=False):
 
     """
     # NOTE: one could time align the responses here first
-    f, Sxy = scipy.signal.csd(x, y, fs=fs, nperseg=n, return_onesided=False)
-    _, Sxx = scipy.signal.welch(x, fs=fs, nperseg=n, return_onesided=False)
+    estimator = WelchEstimator(n, fs)
+    estimator.process(np.stack((x, y)))
+    f, Sxx, _, Sxy = estimator.spectra()
+
+    return wiener_filter_from_spectra(f, Sxx, Sxy, reg=reg, constrained=constrained)
 
-    Sxx += reg
+
+def wiener_filter_from_spectra(f, Sxx, Sxy, reg=0, constrained=False):
+    """Compute optimal wiener filter from two-sided power spectral densities.
+
+    Parameters
+    ----------
+    f : array_like
+        Frequencies of the spectra.
+    Sxx : array_like
+        Auto power spectral density of reference signal.
+    Sxy : array_like
+        Cross power spectral density of reference and disturbance signal.
+    reg : float, optional
+        Regularization added to Sxx.
+    constrained : bool, optional
+        If True, constrain filter to be causal.
+
+    Returns
+    -------
+    numpy.ndarray, shape (len(Sxx),)
+        Optimal wiener filter.
+
+    """
+    n = len(Sxx)
+    Sxx = Sxx + reg
 
     if DEBUG:
         nplot = n // 2  # plot only positive freqs
         _, ax = plt.subplots()
         ax.loglog(f[:nplot], Sxx[:nplot] - reg, 'b', label="Sxx")
         ax.loglog(f[:nplot], reg * np.ones(nplot), 'k--', label="reg")
-        ax.loglog(f[:nplot], reg + Sxx[:nplot] , 'b--', label="Sxx + reg")
+        ax.loglog(f[:nplot], Sxx[:nplot] , 'b--', label="Sxx + reg")
 
         plt.loglog(f[:nplot], np.abs(Sxy[:nplot]), 'r', label="Sxy")
         plt.title("$H_{step2}$: Cross and Auto Power spectral densities")
@@ -88,6 +124,70 @@ def wiener_filter(x, y, n, reg=0, constrained=False):
     return np.real(np.fft.ifft(np.fft.fft(h * np.fft.ifft(Sxy / F.conj()), n=n) / F))
 
 
+def welch_estimators_from_file(recording_file, npersegs, channels, blocksize=None):
+    """Estimate cross spectral matrices of a recording for several segment lengths.
+
+    The recording is read once, block by block, into one `WelchEstimator` per
+    segment length, such that memory does not grow with the length of the
+    recording.
+
+    Parameters
+    ----------
+    recording_file : str or Path
+        Recording.
+    npersegs : iterable of int
+        Segment lengths.
+    channels : list of int
+        Channel indices of the recording to use.
+    blocksize : int, optional
+        Samples read per block. Default: 16 * max(npersegs).
+
+    Returns
+    -------
+    dict
+        `WelchEstimator` for each segment length.
+
+    """
+    assert sf.info(str(recording_file)).samplerate == fs
+
+    estimators = {nperseg: WelchEstimator(nperseg, fs, nch=len(channels)) for nperseg in npersegs}
+    for block in sf.blocks(str(recording_file), blocksize=blocksize or 16 * max(npersegs), always_2d=True):
+        x = block[:, channels].T
+        for estimator in estimators.values():
+            estimator.process(x)
+
+    return estimators
+
+
+def wiener_filter_from_file(recording_file, n, x_ch, y_ch, reg=0, constrained=False, blocksize=None):
+    """Compute optimal wiener filter from two channels of a recording.
+
+    Parameters
+    ----------
+    recording_file : str or Path
+        Recording holding reference and disturbance signal.
+    n : int
+        Output filter length.
+    x_ch, y_ch : int
+        Channel indices of reference and disturbance signal.
+    reg : float, optional
+        Regularization added to Sxx.
+    constrained : bool, optional
+        If True, constrain filter to be causal.
+    blocksize : int, optional
+        Samples read per block. Default: 16 * n.
+
+    Returns
+    -------
+    numpy.ndarray, shape (n,)
+        Optimal wiener filter.
+
+    """
+    estimator = welch_estimators_from_file(recording_file, [n], [x_ch, y_ch], blocksize=blocksize)[n]
+    f, Sxx, _, Sxy = estimator.spectra()
+    return wiener_filter_from_spectra(f, Sxx, Sxy, reg=reg, constrained=constrained)
+
+
 def generate_bands_for_firls(bands, gains):
     bands_pairs = [
         bands[i : i + 2] for i in range(0, len(bands)) if len(bands[i : i + 2]) == 2
@@ -98,6 +198,37 @@ def generate_bands_for_firls(bands, gains):
     return bands_corners, gains_corners
 
 
+def read_early_reflections(odeon_early_reflections_file, nrows=2):
+    """Read the first rows of the table in an Odeon early reflections file.
+
+    The table starts after the header line beginning with `Refl`. Columns are
+    tab separated and use decimal commas.
+
+    Returns
+    -------
+    numpy.ndarray, shape (nrows, ncolumns)
+        Reflection number, arrival time relative to source and to direct
+        sound in ms, levels in dB SPL in octave bands from 63 Hz to 8 kHz,
+        order, azimuth, elevation and source. The first row is the direct
+        sound.
+
+    """
+    rows = []
+    with open(odeon_early_reflections_file, encoding="latin-1") as f:
+        for line in f:
+            if line.startswith("Refl"):
+                break
+        else:
+            raise ValueError(f"Could not find table of reflections in {odeon_early_reflections_file}")
+
+        for line in f:
+            if len(rows) == nrows or not line.strip():
+                break
+            rows.append([float(value.replace(",", ".")) for value in line.strip().split("\t")])
+
+    return np.array(rows)
+
+
 def compute_H_R_H_D(odeon_early_reflections_file):
     """Compute impulse response that represents the target ratio of reflected
     (H_R) to direct (H_D) sound in the Odeon simulation.
@@ -106,15 +237,13 @@ def compute_H_R_H_D(odeon_early_reflections_file):
     times. From these quantities, we generate a
     """
     # Load impulse responses from similation: Hr and Hd
-    df = pd.read_csv(
-        odeon_early_reflections_file, header=3, delimiter="\t", decimal=","
-    )
+    reflections = read_early_reflections(odeon_early_reflections_file)
 
     bands = [63, 125, 250, 500, 1000, 2000, 4000, 8000]
 
-    direct_spl = df.iloc[0, 3:11].to_numpy(dtype=np.float)
-    reflec_spl = df.iloc[1, 3:11].to_numpy(dtype=np.float)
-    target_delay = df.iloc[1, 2] / 1000
+    direct_spl = reflections[0, 3:11]
+    reflec_spl = reflections[1, 3:11]
+    target_delay = reflections[1, 2] / 1000
     gain_dB = reflec_spl - direct_spl
     gains = 10 ** (gain_dB / 20)
 
@@ -131,7 +260,7 @@ def compute_H_R_H_D(odeon_early_reflections_file):
     h_r_h_d = response.align(h_linear, target_dirac)
 
     if False:
-        print(df)
+        print(reflections)
         fig = Response.from_time(fs, h_r_h_d).plot_magnitude(label="H_R_H_D")
         fig.gca().semilogx(bands, gain_dB, label="Odeon")
         plt.title("Comparison of $H_R/H_D$ to Odeon reflection in magnitude")
@@ -145,6 +274,13 @@ def compute_H_R_H_D(odeon_early_reflections_file):
     return h_r_h_d
 
 
+def load_H_R_H_D(room_targets_file, room):
+    """Load H_R / H_D of a room from an archive of `compute_room_targets`."""
+    with np.load(room_targets_file) as data:
+        assert data["fs"] == fs
+        return data[room]
+
+
 def load_H_avil(h_avil_file):
     with np.load(h_avil_file) as data:
         assert data["fs"] == fs
@@ -172,36 +308,40 @@ def load_W_ref(lora_w_file):
 
 
 def compute_H_direct_avil(h_direct_avil_recording_file, reg, window_length=1024, headset_ch=1, measmic_ch=0, constrained=True):
-    # load recording
-    data, fsf = sf.read(h_direct_avil_recording_file)
-    assert fsf == fs
-    x = data[:, headset_ch]  # headset mic
-    y = data[:, measmic_ch]  # calibration mic
+    compare_window_lengths = False
 
-    if False:
-        nperseg = 2048
-        h = wiener_filter(x, y, nperseg, reg=reg, constrained=constrained)
-        fig = Response.from_time(fs, h).plot(label=f"nperseg = {nperseg}")
-        nperseg = 1024
-        h = wiener_filter(x, y, nperseg, reg=reg, constrained=constrained)
-        fig = Response.from_time(fs, h).plot(use_fig=fig, label=f"nperseg = {nperseg}")
-        nperseg = 512
-        h = wiener_filter(x, y, nperseg, reg=reg, constrained=constrained)
-        fig = Response.from_time(fs, h).plot(use_fig=fig, label=f"nperseg = {nperseg}")
-        nperseg = window_length
-        h = wiener_filter(x, y, nperseg, reg=reg, constrained=constrained)
-        fig = Response.from_time(fs, h).plot(use_fig=fig, label=f"nperseg = {nperseg} CHOSEN")
-        plt.suptitle("$H_{step2}$: check that long filter does not have more energy.")
+    # all segment lengths are estimated from one read of the recording
+    npersegs = {window_length}
+    if compare_window_lengths:
+        npersegs |= {2048, 1024, 512}
+
+    # headset mic (x) and calibration mic (y)
+    estimators = welch_estimators_from_file(h_direct_avil_recording_file, npersegs, [headset_ch, measmic_ch])
+
+    if compare_window_lengths:
+        fig = None
+        for nperseg in [2048, 1024, 512]:
+            f, Sxx, _, Sxy = estimators[nperseg].spectra()
+            h = wiener_filter_from_spectra(f, Sxx, Sxy, reg=reg, constrained=constrained)
+            fig = Response.from_time(fs, h).plot(use_fig=fig, label=f"nperseg = {nperseg}")
 
     nperseg = window_length
-    h = wiener_filter(x, y, nperseg, reg=reg, constrained=constrained)
+    f, Sxx, _, Sxy = estimators[nperseg].spectra()
+    h = wiener_filter_from_spectra(f, Sxx, Sxy, reg=reg, constrained=constrained)
+
+    if compare_window_lengths:
+        fig = Response.from_time(fs, h).plot(use_fig=fig, label=f"nperseg = {nperseg} CHOSEN")
+        plt.suptitle("$H_{step2}$: check that long filter does not have more energy.")
 
     # process response
     r = Response.from_time(fs, h)
 
     if DEBUG:
+        # time aligned signals, the delay would bias the coherence at high frequencies
+        data, fsf = sf.read(h_direct_avil_recording_file)
+        assert fsf == fs
         _, ax = plt.subplots()
-        f, Cxy = utils.coherence_csd(x, y, fs, nperseg=4096 * 8)
+        f, Cxy = utils.coherence_csd(data[:, headset_ch], data[:, measmic_ch], fs, nperseg=4096 * 8)
         ax.semilogx(f, Cxy)
         plt.title("$H_{step2}$: Coherence Cxy between measurement and headset mics\nshould be close to 1 in speech range")
 
@@ -210,38 +350,60 @@ def compute_H_direct_avil(h_direct_avil_recording_file, reg, window_length=1024,
     return r.in_time
 
 
-def compute_compensation_filter(h_R_h_D, h_direct_avil, h_avil, w_ref, M, reg):
-    """Compute two things: a minimum phase filter that compensates for gain, and a delay that compensates time shifts."""
-    N = 64
-    assert h_avil.shape[0] == w_ref.shape[0] == N, f"need {64} channels in avil"
+def predict_avil_response(h_avil, w):
+    """Predict the response of the AVIL to a filter bank.
 
-    ## gain
+    Computes the sum over all loudspeakers of the convolution of the AVIL
+    response with the filter of that loudspeaker in one pass in frequency
+    domain.
 
-    # what comes out of avil
-    h_current = np.zeros(h_avil.shape[1] + w_ref.shape[1] - 1)
-    for i in range(N):
-        h_current += np.convolve(h_avil[i], w_ref[i])
+    Parameters
+    ----------
+    h_avil : ndarray, shape (nch, nh)
+        AVIL impulse responses.
+    w : ndarray, shape (nch, nw)
+        Filter bank, e.g. lora filters.
 
-    # what we want
-    h_target = np.convolve(h_R_h_D, h_direct_avil)
+    Returns
+    -------
+    numpy.ndarray, shape (nh + nw - 1,)
+        Impulse response of the AVIL playing w.
 
-    # calibration_gain = H_target / H_current
-    nsamples = max(len(h_target), len(h_current))
-    calibration_gain = np.abs(np.fft.rfft(h_target, n=nsamples)) /(np.abs(np.fft.rfft(h_current, n=nsamples)) + reg)
+    """
+    n = h_avil.shape[1] + w.shape[1] - 1
+    nfft = scipy.fft.next_fast_len(n, real=True)
+    H_avil = scipy.fft.rfft(h_avil, n=nfft, axis=-1)
+    W = scipy.fft.rfft(w, n=nfft, axis=-1)
+    return scipy.fft.irfft(np.einsum("ij,ij->j", H_avil, W), n=nfft)[:n]
 
-    # average calibration_gain over bands in log scale
-    band_center_freqs = [32, 63, 125, 250, 500, 1000, 2000, 4000, 8000, 16000]  # include 32 and 16000 only to get start_end_freqs
+
+def average_over_bands(gain, nsamples):
+    """Average a magnitude spectrum over the bands of BAND_CENTER_FREQS in log scale.
+
+    Parameters
+    ----------
+    gain : ndarray, shape (nsamples // 2 + 1,)
+        Magnitude spectrum.
+    nsamples : int
+        Length of the time signal of the spectrum.
+
+    Returns
+    -------
+    numpy.ndarray, shape (len(BAND_CENTER_FREQS),)
+        Mean gain in each band.
+
+    """
     band_startend_freqs = [
         np.sqrt(b[0] * b[1])
         for b in [
-            band_center_freqs[i : i + 2] for i in range(0, len(band_center_freqs)) if len(band_center_freqs[i : i + 2]) == 2
+            BAND_CENTER_FREQS[i : i + 2] for i in range(0, len(BAND_CENTER_FREQS)) if len(BAND_CENTER_FREQS[i : i + 2]) == 2
         ]
     ]
-    mean_of_calibration_gain_over_bands = 10**(np.array(
+    return 10**(np.array(
         [
             np.mean(10 * np.log10(gains))
             for gains in np.split(
-                calibration_gain,
+                gain,
                 [
                     utils.find_nearest(Response.freq_vector(nsamples, fs), b)[1]
                     for b in band_startend_freqs
@@ -250,9 +412,132 @@ def compute_compensation_filter(h_R_h_D, h_direct_avil, h_avil, w_ref, M, reg):
         ]
     ) / 10)
 
+
+@functools.lru_cache(maxsize=None)
+def design_minimum_phase_filter(M, band_gains):
+    """Design minimum phase filter of length M with given gains in octave bands.
+
+    Parameters
+    ----------
+    M : int
+        Filter length. Must be odd.
+    band_gains : tuple
+        Gains at BAND_CENTER_FREQS, as tuple such that designs can be cached.
+
+    Returns
+    -------
+    h_linear_phase, h_minimum_phase : numpy.ndarray, shape (M,)
+        Linear phase filter and minimum phase filter with the same magnitude.
+
+    """
+    # we are only interested in bands 63 to 8000 so just set first and last to f=0 and f=fs/2 for firwin2
+    band_center_freqs = [0] + BAND_CENTER_FREQS[1:-1] + [fs / 2]
+
+    # design linear phase filter with calibration_gain as magnitude
+    h_linear_phase = scipy.signal.firwin2(M, band_center_freqs, band_gains, fs=fs)
+    h_minimum_phase_square_root_mag = scipy.signal.minimum_phase(h_linear_phase)
+    h_minimum_phase = np.convolve(h_minimum_phase_square_root_mag, h_minimum_phase_square_root_mag)
+
+    return h_linear_phase, h_minimum_phase
+
+
+def band_errors(h, band_gains, nsamples):
+    """Magnitude error in dB of filter h in the octave bands from 63 Hz to 8 kHz."""
+    achieved = average_over_bands(np.abs(np.fft.rfft(h, n=nsamples)), nsamples)
+    return 20 * np.log10(achieved / np.array(band_gains))[1:-1]
+
+
+def find_filter_length(band_gains, nsamples, tolerance_dB, max_length=MAX_FILTER_LENGTH):
+    """Find shortest odd filter length with octave band errors within tolerance.
+
+    Bisection over odd lengths from 3 to `max_length`, assuming that the
+    error decreases with the filter length.
+    """
+    def within_tolerance(k):
+        _, h = design_minimum_phase_filter(2 * k + 1, band_gains)
+        return np.max(np.abs(band_errors(h, band_gains, nsamples))) <= tolerance_dB
+
+    lo, hi = 1, (max_length - 1) // 2
+    if not within_tolerance(hi):
+        print(f"WARNING: no filter up to length {max_length} is within {tolerance_dB} dB. Using length {max_length}.")
+        return 2 * hi + 1
+
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if within_tolerance(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    return 2 * lo + 1
+
+
+def compute_calibration_gain(h_target, h_current, reg):
+    """Magnitude of H_target / H_current, regularized with reg.
+
+    Returns
+    -------
+    calibration_gain : numpy.ndarray, shape (nsamples // 2 + 1,)
+        Gain at the frequencies of `Response.freq_vector(nsamples, fs)`.
+    nsamples : int
+        Length of the longer response.
+
+    """
+    nsamples = max(len(h_target), len(h_current))
+    calibration_gain = np.abs(np.fft.rfft(h_target, n=nsamples)) /(np.abs(np.fft.rfft(h_current, n=nsamples)) + reg)
+    return calibration_gain, nsamples
+
+
+def compute_delay(h_target, h_current):
+    """Delay in samples between target and current response."""
+    # pad to same length before comparing
+    if len(h_current) > len(h_target):
+        h_target = np.pad(h_target, (0, len(h_current) - len(h_target)))
+    elif len(h_current) < len(h_target):
+        h_current = np.pad(h_current, (0, len(h_target) - len(h_current)))
+    # same as response.delay_between, but with FFT based correlation for long responses
+    xcorr = scipy.signal.correlate(h_current, h_target, mode="full")
+    return int(np.argmax(xcorr)) - len(h_target) + 1
+
+
+def compute_compensation_filter(h_R_h_D, h_direct_avil, h_avil, w_ref, M, reg, *, tolerance_dB=1.0, h_current=None):
+    """Compute two things: a minimum phase filter that compensates for gain, and a delay that compensates time shifts.
+
+    The AVIL response to the reference filters is given either as AVIL
+    impulse responses `h_avil` and reference lora filters `w_ref`, or
+    directly as their predicted response, the keyword argument `h_current`,
+    e.g. from the cache. Then h_avil and w_ref must be None.
+
+    If M is None, the filter length is the shortest odd length whose error in
+    octave bands is at most tolerance_dB.
+    """
+    if h_current is None and (h_avil is None or w_ref is None):
+        raise ValueError("give h_avil and w_ref, or h_current")
+    if h_current is not None and (h_avil is not None or w_ref is not None):
+        raise ValueError("give either h_avil and w_ref, or h_current, not both")
+
+    ## gain
+
+    # what comes out of avil
+    if h_current is None:
+        N = 64
+        assert h_avil.shape[0] == w_ref.shape[0] == N, f"need {64} channels in avil"
+        h_current = predict_avil_response(h_avil, w_ref)
+
+    # what we want
+    h_target = np.convolve(h_R_h_D, h_direct_avil)
+
+    calibration_gain, nsamples = compute_calibration_gain(h_target, h_current, reg)
+
+    # average calibration_gain over bands in log scale
+    mean_of_calibration_gain_over_bands = average_over_bands(calibration_gain, nsamples)
+    band_gains = tuple(mean_of_calibration_gain_over_bands.tolist())
+
+    if M is None:
+        M = find_filter_length(band_gains, nsamples, tolerance_dB)
+
     # we are only interested in bands 63 to 8000 so just set first and last to f=0 and f=fs/2 for firwin2
-    band_center_freqs[0] = 0
-    band_center_freqs[-1] = fs / 2
+    band_center_freqs = [0] + BAND_CENTER_FREQS[1:-1] + [fs / 2]
 
     if DEBUG:
         plt.figure()
@@ -260,23 +545,22 @@ def compute_compensation_filter(h_R_h_D, h_direct_avil, h_avil, w_ref, M, reg):
         plt.semilogx(Response.freq_vector(nsamples, fs), 10*np.log10(calibration_gain), label="target calibration gain")
         plt.semilogx(band_center_freqs, 10*np.log10(mean_of_calibration_gain_over_bands), label="target calibration gain in octave bands")
 
-    # design linear phase filter with calibration_gain as magnitude
-    for Mc in [32, 128, 512, 1024]:
-        Mc -= 1
-        h_linear_phase = scipy.signal.firwin2(Mc, band_center_freqs, mean_of_calibration_gain_over_bands, fs=fs)
-        h_minimum_phase_square_root_mag = scipy.signal.minimum_phase(h_linear_phase)
-        h_minimum_phase = np.convolve(h_minimum_phase_square_root_mag, h_minimum_phase_square_root_mag)
-
-        if DEBUG:
+        # design linear phase filter with calibration_gain as magnitude
+        for Mc in [32, 128, 512, 1024]:
+            Mc -= 1
+            _, h_minimum_phase = design_minimum_phase_filter(Mc, band_gains)
             plt.plot(
                 Response.freq_vector(Mc, fs),
                 10*np.log10(np.abs(np.fft.rfft(h_minimum_phase))),
                 label=f"minimum phase, M = {Mc}",
             )
 
-    h_linear_phase = scipy.signal.firwin2(M, band_center_freqs, mean_of_calibration_gain_over_bands, fs=fs)
-    h_minimum_phase_square_root_mag = scipy.signal.minimum_phase(h_linear_phase)
-    h_minimum_phase = np.convolve(h_minimum_phase_square_root_mag, h_minimum_phase_square_root_mag)
+    h_linear_phase, h_minimum_phase = design_minimum_phase_filter(M, band_gains)
+
+    errors = band_errors(h_minimum_phase, band_gains, nsamples)
+    print(f"Calibration filter has length {M}. Error in octave bands:")
+    print("    " + " ".join(f"{f:>6}" for f in BAND_CENTER_FREQS[1:-1]) + " Hz")
+    print("    " + " ".join(f"{e:6.2f}" for e in errors) + " dB")
 
     if DEBUG:
         plt.plot(
@@ -299,12 +583,7 @@ def compute_compensation_filter(h_R_h_D, h_direct_avil, h_avil, w_ref, M, reg):
 
 
     ## delay shift
-    # pad to same length before comparing
-    if len(h_current > len(h_target)):
-        h_target = np.pad(h_target, (0, len(h_current) - len(h_target)))
-    elif len(h_current < len(h_target)):
-        h_current = np.pad(h_current, (0, len(h_target) - len(h_current)))
-    delay_samples = response.delay_between(h_target, h_current)
+    delay_samples = compute_delay(h_target, h_current)
 
     print(f"Calibration will cut {delay_samples} samples / {delay_samples / fs * 1000:.2f} ms.")
 
@@ -326,6 +605,10 @@ if __name__ == "__main__":
     parser.add_argument(
         "--filter-length", help="set length (N) of minimum_phase filter. Must be odd.", default=511, type=int
     )
+    parser.add_argument(
+        "--auto-filter-length", metavar="TOLERANCE_DB", default=None, type=float,
+        help=f"use the shortest odd filter length up to {MAX_FILTER_LENGTH} whose error in octave bands stays within TOLERANCE_DB. Overrides --filter-length."
+    )
     parser.add_argument(
         "--debug", action="store_true", help="turn on debug plotting", default=False
     )
@@ -356,6 +639,18 @@ if __name__ == "__main__":
         type=Path,
         default=OWNAURA_PATH / "Odeon rooms/Calibration room/AVIL implementation files/10_10_10m_sketchupbase.Job01.00001EarlyReflections.Txt"
     )
+    parser.add_argument(
+        "--room_targets_file",
+        help="archive of H_R / H_D of all rooms from compute_room_targets. The room is the parent folder of the AVIL implementation files of --early_reflections_file",
+        type=Path,
+        default=None
+    )
+    parser.add_argument(
+        "--cache-dir", help="folder of the cache of intermediate results", type=Path, default=DEFAULT_CACHE_DIR
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="compute all intermediate results, do not use or fill the cache", default=False
+    )
 
     args = parser.parse_args()
     DEBUG = args.debug
@@ -364,21 +659,47 @@ if __name__ == "__main__":
     print(f'Using early_reflections_file {args.early_reflections_file}')
     print(f'Using lora_ir_reference_file {args.lora_ir_reference_file}')
 
-    # compute or load
-    print("Computing target response H_R / H_D")
-    h_R_h_D = compute_H_R_H_D(str(args.early_reflections_file))
+    # the debug plots are made while computing the intermediate results
+    if DEBUG and not args.no_cache:
+        print("Not using the cache to show the debug plots")
+    cache = None if args.no_cache or DEBUG else Cache(args.cache_dir)
 
-    print("Computing avil response H_refl_avil")
-    h_avil = load_H_avil(str(args.h_avil_file))
+    # compute or load
+    if args.room_targets_file is not None:
+        room = args.early_reflections_file.parents[1].name
+        print(f"Loading target response H_R / H_D of {room} from {args.room_targets_file}")
+        h_R_h_D = load_H_R_H_D(args.room_targets_file, room)
+    else:
+        print("Computing target response H_R / H_D")
+        h_R_h_D = cached(
+            cache, 'h_R_h_D', lambda: compute_H_R_H_D(str(args.early_reflections_file)),
+            files=[args.early_reflections_file], fs=fs
+        )
 
-    print("Computing odeon reference filter")
-    w_ref = load_W_ref(str(args.lora_ir_reference_file))
+    print("Computing avil response to odeon reference filter")
+    h_current = cached(
+        cache, 'h_current', lambda: predict_avil_response(load_H_avil(str(args.h_avil_file)), load_W_ref(str(args.lora_ir_reference_file))),
+        files=[args.h_avil_file, args.lora_ir_reference_file], fs=fs
+    )
 
     print("Computing h_direct_avil")
-    h_direct_avil = compute_H_direct_avil(args.calibration_recording, reg=args.reg_H_direct_avil, window_length=args.window_length, headset_ch=args.headset_ch, measmic_ch=args.measmic_ch)
+    h_direct_avil = cached(
+        cache, 'h_direct_avil',
+        lambda: compute_H_direct_avil(args.calibration_recording, reg=args.reg_H_direct_avil, window_length=args.window_length, headset_ch=args.headset_ch, measmic_ch=args.measmic_ch),
+        files=[args.calibration_recording], fs=fs, reg=args.reg_H_direct_avil, window_length=args.window_length,
+        headset_ch=args.headset_ch, measmic_ch=args.measmic_ch, constrained=True
+    )
 
     print("Computing calibration filter")
-    h, n = compute_compensation_filter(h_R_h_D, h_direct_avil, h_avil, w_ref, args.filter_length, reg=args.reg_C)
+    if args.auto_filter_length is None:
+        h, n = compute_compensation_filter(
+            h_R_h_D, h_direct_avil, h_avil=None, w_ref=None, M=args.filter_length, reg=args.reg_C, h_current=h_current
+        )
+    else:
+        h, n = compute_compensation_filter(
+            h_R_h_D, h_direct_avil, h_avil=None, w_ref=None, M=None, reg=args.reg_C,
+            tolerance_dB=args.auto_filter_length, h_current=h_current
+        )
 
     np.savez(args.output, h=h, n=n, fs=fs, docs="h: impulse response, n: samples to cut at beginning, fs: samplerate")
     print(f"Created {args.output.resolve()}.npz")
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""Compute the target response H_R / H_D of all Odeon rooms into one archive.
+
+Scans `Odeon rooms` for rooms with an `AVIL implementation files` folder, like
+`Lora filters/odeon_to_lora_filters.py`, designs the targets of all rooms in
+parallel and saves them in one compressed `.npz` archive with the room names
+as keys. Calibration then looks up the target of a room with
+`compute_calibration_filter.load_H_R_H_D` or `--room_targets_file`.
+
+Example
+-------
+    python -m libownaura.compute_room_targets -o room_targets.npz
+
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from libownaura.compute_calibration_filter import OWNAURA_PATH, compute_H_R_H_D, fs
+
+ROOMS_PATH = OWNAURA_PATH / 'Odeon rooms'
+
+
+def find_early_reflections_files(rooms_path=ROOMS_PATH):
+    """Find the early reflections file of each room.
+
+    Returns
+    -------
+    dict
+        Early reflections file for each room name.
+
+    """
+    folders = sorted(x for x in Path(rooms_path).iterdir() if x.is_dir() and (x / 'AVIL implementation files').is_dir())
+    return {room.name: next((room / 'AVIL implementation files').glob("*EarlyReflections.Txt")) for room in folders}
+
+
+def compute_room_targets(early_reflections_files, workers=None):
+    """Compute H_R / H_D for each room in parallel.
+
+    Parameters
+    ----------
+    early_reflections_files : dict
+        Early reflections file for each room name.
+    workers : int, optional
+        Number of worker processes.
+
+    Returns
+    -------
+    dict
+        Target impulse response for each room name.
+
+    """
+    rooms = list(early_reflections_files)
+    with ProcessPoolExecutor(workers) as executor:
+        targets = executor.map(compute_H_R_H_D, [str(early_reflections_files[room]) for room in rooms])
+        return dict(zip(rooms, targets))
+
+
+def save_room_targets(filename, targets):
+    assert 'fs' not in targets, "room must not be named fs"
+    np.savez_compressed(filename, fs=fs, **targets)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute target response H_R / H_D of all Odeon rooms",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-r", "--rooms_path", help="folder holding a folder for each room", type=Path, default=ROOMS_PATH)
+    parser.add_argument("-o", "--output", help="output archive", type=Path, default=OWNAURA_PATH / "room_targets.npz")
+    parser.add_argument("-j", "--workers", help="number of worker processes. Default: number of processors", default=None, type=int)
+
+    args = parser.parse_args()
+
+    early_reflections_files = find_early_reflections_files(args.rooms_path)
+    if not early_reflections_files:
+        raise Exception(f'Could not find any rooms with AVIL implementation files in {args.rooms_path}. Check path!')
+
+    targets = compute_room_targets(early_reflections_files, workers=args.workers)
+    for room, h in targets.items():
+        print(f"{room}: {len(h)} samples")
+
+    save_room_targets(args.output, targets)
+    print(f"Created {args.output}")
@@ -0,0 +1,686 @@
+"""Offline partitioned convolution of a headset recording with lora filters.
+
+Mirrors the real-time convolution of the MAX patches
+(`MAX/singleconv.maxpat`, `MAX/multicore_multiconvolve.maxpat`): one input
+channel, the headset microphone, is convolved with a calibrated lora filter
+bank and gives one output per loudspeaker.
+
+The engine is a uniformly-partitioned overlap-save (UPOLS) convolution. The
+filters are split into partitions of `blocksize` samples whose spectra are
+computed once. The spectra of the past input blocks are kept in a frequency
+domain delay line (FDL) and each output block is the inverse FFT of the sum of
+products of the FDL with the filter spectra.
+
+Example
+-------
+Render the headset channel of a session recording through the filters of a room
+
+    python -m libownaura.convolver "Room 1_calibrated.wav" recording.wav -o "Room 1.wav"
+
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy.fft
+import soundfile as sf
+
+from libownaura.streaming import sliding_windows
+
+# block sizes supported by the RedNet PCIe card settings
+BLOCKSIZES = (32, 64, 128, 256, 512, 1024, 2048)
+
+# maximal number of partitions of a non-uniform segment followed by a larger one
+MAX_PARTITIONS_PER_SEGMENT = 32
+
+# maximal size in bytes of the input windows used in `render`
+RENDER_CHUNK_BYTES = 2**26
+
+
+def check_blocksize(blocksize):
+    if blocksize < 1 or blocksize & (blocksize - 1):
+        raise ValueError(f"blocksize must be a power of two, got {blocksize}")
+
+
+def partition_filters(w, blocksize, dtype=np.complex64):
+    """Compute the spectra of the filter partitions.
+
+    Parameters
+    ----------
+    w : ndarray, shape (nout, nsample)
+        Filter bank.
+    blocksize : int
+        Length of one partition.
+    dtype : numpy.dtype, optional
+        Complex dtype of the spectra.
+
+    Returns
+    -------
+    ndarray, shape (blocksize + 1, npart, nout)
+        Spectra of the zero padded partitions. `npart` is the number of
+        partitions needed to hold `nsample` samples.
+
+    """
+    nout, nsample = w.shape
+    npart = -(-nsample // blocksize)
+
+    W = np.empty((blocksize + 1, npart, nout), dtype=dtype)
+    for k in range(nout):
+        parts = np.zeros((npart, 2 * blocksize), dtype=w.dtype)
+        parts[:, :blocksize].flat[:nsample] = w[k]
+        W[:, :, k] = scipy.fft.rfft(parts, axis=-1).T
+
+    return W
+
+
+def pad_input_spectra(X, npad):
+    """Transpose input spectra to shape (blocksize + 1, npad + nblocks) with npad silent blocks first.
+
+    Convolvers with up to npad + 1 partitions can render from the result
+    with `render_chunks(..., npad=npad)`, without padding it again.
+    """
+    Xpad = np.zeros((X.shape[1], npad + X.shape[0]), dtype=X.dtype)
+    Xpad[:, npad:] = X.T
+    return Xpad
+
+
+def pad_partitions(W, npart):
+    """Zero-pad partition spectra W to npart partitions."""
+    assert W.shape[1] <= npart, f"W already has {W.shape[1]} partitions"
+    return np.pad(W, ((0, 0), (0, npart - W.shape[1]), (0, 0)))
+
+
+def partition_input(x, blocksize, dtype=np.complex64):
+    """Compute the spectra of the overlap-save input frames.
+
+    Frame `j` holds the samples of input blocks `j - 1` and `j`.
+
+    Parameters
+    ----------
+    x : ndarray, shape (nt,)
+        Input signal. Its length must be a multiple of `blocksize`.
+    blocksize : int
+        Block size.
+
+    Returns
+    -------
+    ndarray, shape (nt // blocksize, blocksize + 1)
+        Spectra of the input frames.
+
+    """
+    assert x.shape[0] % blocksize == 0, "input length must be a multiple of blocksize"
+    xpad = np.concatenate((np.zeros(blocksize, dtype=x.dtype), x))
+    frames = sliding_windows(xpad, 2 * blocksize, blocksize)
+    return scipy.fft.rfft(frames, axis=-1).astype(dtype, copy=False)
+
+
+class UniformPartitionedConvolver:
+    """Uniformly-partitioned overlap-save convolution of one input with many filters.
+
+    Parameters
+    ----------
+    W : ndarray, shape (blocksize + 1, npart, nout)
+        Filter partition spectra as returned by `partition_filters`.
+    blocksize : int
+        Block size, a power of two. The real-time chain uses one of
+        `BLOCKSIZES`.
+    nsample : int, optional
+        Length of the filters. Defaults to `npart * blocksize`.
+
+    """
+
+    def __init__(self, W, blocksize, nsample=None):
+        check_blocksize(blocksize)
+        assert W.shape[0] == blocksize + 1, "spectra do not match blocksize"
+
+        self.W = W
+        self.blocksize = blocksize
+        self.npart = W.shape[1]
+        self.nout = W.shape[2]
+        self.nsample = self.npart * blocksize if nsample is None else nsample
+        self.reset()
+
+    @classmethod
+    def from_filters(cls, w, blocksize, dtype=np.complex64):
+        """Create convolver from filter bank `w` of shape (nout, nsample)."""
+        return cls(partition_filters(w, blocksize, dtype=dtype), blocksize, nsample=w.shape[1])
+
+    @classmethod
+    def from_wav(cls, filter_file, blocksize, dtype=np.complex64):
+        """Create convolver from a (calibrated) lora filter wav file."""
+        w, _ = sf.read(filter_file, dtype=np.float32 if dtype == np.complex64 else np.float64)
+        return cls.from_filters(w.T, blocksize, dtype=dtype)
+
+    def reset(self):
+        """Clear input buffer and frequency domain delay line."""
+        real_dtype = np.finfo(self.W.dtype).dtype
+        self.frame = np.zeros(2 * self.blocksize, dtype=real_dtype)
+        self.fdl = np.zeros((self.blocksize + 1, 1, self.npart), dtype=self.W.dtype)
+        self.fade = None
+        self.last_npart_computed = 0
+
+    def switch_filters(self, W, nblocks):
+        """Crossfade to new filters during the next nblocks blocks.
+
+        During the fade, the output of the old and the new filters is
+        computed and blended with a raised cosine. Partitions that are equal
+        in both filter banks are computed only once, so a block costs at most
+        twice as many spectral products as without fade. The number of
+        partition products of the last block is in `last_npart_computed`.
+
+        Parameters
+        ----------
+        W : ndarray, shape (blocksize + 1, npart, nout)
+            Partition spectra of the new filters, with the same shape as the
+            current ones. Use `pad_partitions` for filters of different length.
+        nblocks : int
+            Length of the crossfade in blocks. With 0, switch immediately.
+
+        Notes
+        -----
+        Switching during a running fade starts the new fade from the current
+        blend of the old and the new filters of the running fade.
+
+        """
+        assert W.shape == self.W.shape, f"new filter spectra have shape {W.shape}, need {self.W.shape}"
+
+        if self.fade is not None:
+            # fade out from the current blend of the running fade. Its gain is
+            # held, so the blend is a filter bank itself.
+            fade = self.fade
+            differ = fade['differ']
+            W_blend = fade['W_old'].copy()
+            W_blend[:, differ] += fade['gain'] * (fade['W'][:, differ] - W_blend[:, differ])
+            self.W = W_blend
+            self.fade = None
+
+        differ = np.flatnonzero(np.any(W != self.W, axis=(0, 2)))
+        if nblocks == 0 or differ.size == 0:
+            self.W = W
+            return
+
+        self.fade = {
+            'W': W,
+            'W_old': self.W,
+            'same': np.flatnonzero(np.all(W == self.W, axis=(0, 2))),
+            'differ': differ,
+            'nblocks': nblocks,
+            'block': 0,
+            'gain': 0.0,
+        }
+
+    def process_block(self, x):
+        """Convolve the next input block.
+
+        Parameters
+        ----------
+        x : ndarray, shape (blocksize,)
+            Input block.
+
+        Returns
+        -------
+        ndarray, shape (nout, blocksize)
+            Output block for each filter.
+
+        """
+        B = self.blocksize
+        self.frame[:B] = self.frame[B:]
+        self.frame[B:] = x
+
+        self.fdl[:, :, 1:] = self.fdl[:, :, :-1]
+        self.fdl[:, 0, 0] = scipy.fft.rfft(self.frame)
+
+        if self.fade is not None:
+            return self._process_fade_block()
+
+        self.last_npart_computed = self.npart
+        Y = np.matmul(self.fdl, self.W)[:, 0, :]
+        return scipy.fft.irfft(Y, n=2 * B, axis=0)[B:].T
+
+    def _process_fade_block(self):
+        """Blend the outputs of old and new filters for one block."""
+        B = self.blocksize
+        fade = self.fade
+        same, differ = fade['same'], fade['differ']
+
+        # shared partitions plus old and new version of the differing ones
+        fdl_differ = self.fdl[:, :, differ]
+        Y_old = np.matmul(fdl_differ, fade['W_old'][:, differ])[:, 0, :]
+        Y_change = np.matmul(fdl_differ, fade['W'][:, differ])[:, 0, :] - Y_old
+        if same.size:
+            Y_old += np.matmul(self.fdl[:, :, same], fade['W'][:, same])[:, 0, :]
+        self.last_npart_computed = self.npart + differ.size
+
+        y_old = scipy.fft.irfft(Y_old, n=2 * B, axis=0)[B:].T
+        y_change = scipy.fft.irfft(Y_change, n=2 * B, axis=0)[B:].T
+
+        # raised cosine from 0 to 1 over all blocks of the fade
+        t = (fade['block'] * B + np.arange(1, B + 1)) / (fade['nblocks'] * B)
+        gain = (0.5 - 0.5 * np.cos(np.pi * t)).astype(y_old.dtype)
+
+        fade['block'] += 1
+        fade['gain'] = float(gain[-1])
+        if fade['block'] == fade['nblocks']:
+            self.W = fade['W']
+            self.fade = None
+
+        return y_old + gain * y_change
+
+    def input_spectra(self, x):
+        """Overlap-save frame spectra of `x` padded to hold the full convolution."""
+        B = self.blocksize
+        nblocks = -(-(x.shape[0] + self.nsample - 1) // B)
+
+        xpad = np.zeros(nblocks * B, dtype=self.frame.dtype)
+        xpad[:x.shape[0]] = x
+        return partition_input(xpad, B, dtype=self.W.dtype)
+
+    def render(self, x):
+        """Convolve a whole input signal, independent of the streaming state.
+
+        Many blocks are processed at once, which is equivalent to calling
+        `process_block` on each block but much faster.
+
+        Parameters
+        ----------
+        x : ndarray, shape (nt,)
+            Input signal.
+
+        Returns
+        -------
+        ndarray, shape (nout, nt + nsample - 1)
+            Full convolution of `x` with each filter.
+
+        """
+        y = np.concatenate(list(self.render_chunks(self.input_spectra(x))), axis=-1)
+        return y[:, :x.shape[0] + self.nsample - 1]
+
+    def render_chunks(self, X, npad=None):
+        """Convolve input given by its overlap-save frame spectra.
+
+        Parameters
+        ----------
+        X : ndarray, shape (nblocks, blocksize + 1)
+            Input spectra as returned by `partition_input`, or as returned by
+            `pad_input_spectra` if npad is given.
+        npad : int, optional
+            Number of silent blocks before the input in X, at least
+            `npart - 1`.
+
+        Yields
+        ------
+        ndarray, shape (nout, nchunk * blocksize)
+            Consecutive chunks of the output signal of each filter.
+
+        """
+        B = self.blocksize
+
+        # pad with npart - 1 silent blocks, such that window j holds the
+        # spectra of blocks j - npart + 1 ... j
+        if npad is None:
+            Xpad = pad_input_spectra(X.astype(self.W.dtype, copy=False), self.npart - 1)
+        else:
+            assert npad >= self.npart - 1, f"need {self.npart - 1} silent blocks, X has {npad}"
+            Xpad = X[:, npad - (self.npart - 1):]
+        nblocks = Xpad.shape[1] - (self.npart - 1)
+        windows = sliding_windows(Xpad, self.npart)[:, :, ::-1]
+
+        nchunk = max(1, RENDER_CHUNK_BYTES // (windows.itemsize * (B + 1) * self.npart))
+        for j in range(0, nblocks, nchunk):
+            Y = np.matmul(windows[:, j:j + nchunk], self.W)
+            y = scipy.fft.irfft(Y, n=2 * B, axis=0)[B:]
+            yield y.transpose(2, 1, 0).reshape(self.nout, -1)
+
+
+class NonUniformPartitionedConvolver:
+    """Non-uniformly partitioned convolution with a low-latency head.
+
+    The filters are split into consecutive segments. Each segment is convolved
+    by its own `UniformPartitionedConvolver` with a block size that grows along
+    the filter: a small head block for the first milliseconds that sets the
+    latency, and larger, cheaper blocks for the reverberant tail.
+
+    A segment with block size `Bk` must start at filter offset `Dk >= Bk`. Its
+    output then always arrives in time for the head block that plays it, and
+    a real-time implementation could spread its FFTs over `Bk` samples.
+
+    Parameters
+    ----------
+    w : ndarray, shape (nout, nsample)
+        Filter bank.
+    layout : list of (blocksize, npart) tuples
+        Block size and number of partitions of each segment, starting with
+        the head. See `plan_partitions`.
+    dtype : numpy.dtype, optional
+        Complex dtype of the spectra.
+
+    """
+
+    def __init__(self, w, layout, dtype=np.complex64):
+        self.layout = layout
+        self.blocksize = layout[0][0]
+        self.nout, self.nsample = w.shape
+
+        self.segments = []
+        self.offsets = []
+        offset = 0
+        for blocksize, npart in layout:
+            if offset >= self.nsample:
+                break
+            assert blocksize % self.blocksize == 0, "segment block sizes must be multiples of the head block size"
+            assert offset == 0 or offset >= blocksize, f"segment with block size {blocksize} starts too early at {offset}"
+            self.segments.append(UniformPartitionedConvolver.from_filters(w[:, offset:offset + blocksize * npart], blocksize, dtype=dtype))
+            self.offsets.append(offset)
+            offset += blocksize * npart
+        assert offset >= self.nsample, "layout is shorter than filters"
+
+        self.reset()
+
+    @classmethod
+    def from_wav(cls, filter_file, layout, dtype=np.complex64):
+        """Create convolver from a (calibrated) lora filter wav file."""
+        w, _ = sf.read(filter_file, dtype=np.float32 if dtype == np.complex64 else np.float64)
+        return cls(w.T, layout, dtype=dtype)
+
+    def reset(self):
+        """Clear all segments and the output accumulator."""
+        B = self.blocksize
+        for segment in self.segments:
+            segment.reset()
+        self.t = 0
+        self.inbuf = np.zeros(max(segment.blocksize for segment in self.segments), dtype=self.segments[0].frame.dtype)
+        # ring buffer of future output, a multiple of the head block size
+        self.accumulator = np.zeros((self.nout, B * (-(-max(self.offsets) // B) + 2)), dtype=self.inbuf.dtype)
+
+    def process_block(self, x):
+        """Convolve the next input block.
+
+        Parameters
+        ----------
+        x : ndarray, shape (blocksize,)
+            Input block of the head block size.
+
+        Returns
+        -------
+        ndarray, shape (nout, blocksize)
+            Output block for each filter.
+
+        """
+        B = self.blocksize
+        L = self.accumulator.shape[1]
+
+        self.inbuf[:-B] = self.inbuf[B:]
+        self.inbuf[-B:] = x
+        self.t += B
+
+        y = self.segments[0].process_block(x)
+        for segment, offset in zip(self.segments[1:], self.offsets[1:]):
+            Bk = segment.blocksize
+            if self.t % Bk:
+                continue
+            # add output of block starting at t - Bk to samples t - Bk + offset ...
+            start = (self.t - Bk + offset) % L
+            yk = segment.process_block(self.inbuf[-Bk:])
+            nfirst = min(Bk, L - start)
+            self.accumulator[:, start:start + nfirst] += yk[:, :nfirst]
+            self.accumulator[:, :Bk - nfirst] += yk[:, nfirst:]
+
+        start = (self.t - B) % L
+        y += self.accumulator[:, start:start + B]
+        self.accumulator[:, start:start + B] = 0
+
+        return y
+
+    def render(self, x):
+        """Convolve a whole input signal, independent of the streaming state.
+
+        Parameters
+        ----------
+        x : ndarray, shape (nt,)
+            Input signal.
+
+        Returns
+        -------
+        ndarray, shape (nout, nt + nsample - 1)
+            Full convolution of `x` with each filter.
+
+        """
+        y = np.zeros((self.nout, x.shape[0] + self.nsample - 1), dtype=self.inbuf.dtype)
+        for segment, offset in zip(self.segments, self.offsets):
+            yk = segment.render(x)
+            y[:, offset:offset + yk.shape[1]] += yk[:, :y.shape[1] - offset]
+        return y
+
+
+def segment_cost(blocksize, npart, nout):
+    """Estimated floating point operations per sample of one uniform segment.
+
+    Per block, one forward real FFT of the input frame, `nout` inverse real
+    FFTs and `npart * nout * (blocksize + 1)` complex multiply-adds.
+    """
+    nfft = 2 * blocksize
+    fft = 2.5 * nfft * np.log2(nfft)
+    return (fft * (1 + nout) + 8 * npart * nout * (blocksize + 1)) / blocksize
+
+
+def plan_partitions(nsample, latency, nout=64, max_blocksize=2**16):
+    """Find the partition layout with minimal cost for a latency budget.
+
+    The head block size is the largest of `BLOCKSIZES` within the latency
+    budget. Following segments double the block size and each starts at an
+    offset at least as large as its block size. The number of partitions per
+    segment is found by dynamic programming over the segment offsets to
+    minimize `segment_cost`.
+
+    Parameters
+    ----------
+    nsample : int
+        Filter length.
+    latency : int
+        Latency budget in samples, at least `BLOCKSIZES[0]`.
+    nout : int, optional
+        Number of output channels.
+    max_blocksize : int, optional
+        Largest block size considered.
+
+    Returns
+    -------
+    layout : list of (blocksize, npart) tuples
+        Block size and number of partitions of each segment.
+    cost : float
+        Estimated floating point operations per sample.
+
+    """
+    head = [b for b in BLOCKSIZES if b <= latency]
+    if not head:
+        raise ValueError(f"latency budget must be at least {BLOCKSIZES[0]} samples, got {latency}")
+    blocksizes = [head[-1]]
+    while blocksizes[-1] * 2 <= max_blocksize and blocksizes[-1] * 2 < nsample:
+        blocksizes.append(blocksizes[-1] * 2)
+
+    # uniform layout
+    npart = -(-nsample // blocksizes[0])
+    best = ([(blocksizes[0], npart)], segment_cost(blocksizes[0], npart, nout))
+
+    # states maps the offset where the next segment starts to the cheapest
+    # layout up to there
+    states = {0: ([], 0.0)}
+    for i, blocksize in enumerate(blocksizes):
+        next_states = {}
+        for offset, (layout, cost) in states.items():
+            if i > 0 and offset < blocksize:
+                continue
+
+            # finish the filter with this block size
+            npart = -(-(nsample - offset) // blocksize)
+            total = cost + segment_cost(blocksize, npart, nout)
+            if total < best[1]:
+                best = (layout + [(blocksize, npart)], total)
+
+            # or continue with a larger block size. Only a few partitions of a
+            # size are worth it before doubling, which bounds the search.
+            for npart in range(1, min(MAX_PARTITIONS_PER_SEGMENT, -(-(nsample - offset) // blocksize))):
+                next_offset = offset + npart * blocksize
+                next_cost = cost + segment_cost(blocksize, npart, nout)
+                if next_offset not in next_states or next_cost < next_states[next_offset][1]:
+                    next_states[next_offset] = (layout + [(blocksize, npart)], next_cost)
+        states = next_states
+
+    return best
+
+
+def render_to_file(convolver, x, outfile, fs, X=None, npad=None):
+    """Render x through convolver and write the output chunk by chunk.
+
+    The full output of a long session does not fit into memory.
+
+    Parameters
+    ----------
+    convolver : UniformPartitionedConvolver
+        Convolver or object with the same rendering interface.
+    x : ndarray, shape (nt,)
+        Input signal.
+    outfile : str or Path
+        Output wav file.
+    fs : int
+        Samplerate.
+    X : ndarray, optional
+        Input spectra of `x`, e.g. shared between convolvers with the same
+        block size. Must hold at least as many blocks as
+        `convolver.input_spectra(x)`.
+    npad : int, optional
+        If given, X is padded with `pad_input_spectra`, see `render_chunks`.
+
+    """
+    if X is None:
+        X = convolver.input_spectra(x)
+
+    nconv = x.shape[0] + convolver.nsample - 1
+    with sf.SoundFile(outfile, 'w', samplerate=fs, channels=convolver.nout, subtype='FLOAT') as out:
+        nwritten = 0
+        for y in convolver.render_chunks(X, npad=npad):
+            y = y[:, :nconv - nwritten]
+            out.write(y.T)
+            nwritten += y.shape[1]
+            if nwritten == nconv:
+                break
+
+
+def _run_switches(W, blocks, switches, nblocks):
+    """Convolve blocks and switch to `switches[i]` before block i."""
+    convolver = UniformPartitionedConvolver(W, blocks.shape[1])
+    y = []
+    for i, block in enumerate(blocks):
+        if i in switches:
+            convolver.switch_filters(switches[i], nblocks)
+        y.append(convolver.process_block(block))
+        assert convolver.last_npart_computed <= 2 * convolver.npart
+    return np.concatenate(y, axis=-1)
+
+
+def _switch_test_signals(blocksize, nfilters):
+    fs = 48000
+    rng = np.random.default_rng(0)
+    t = np.arange(fs) / fs
+    decay = np.exp(-t[:fs // 4] / 0.05)
+    w = [(rng.standard_normal((4, fs // 4)) * decay).astype(np.float32) for _ in range(nfilters)]
+    x = np.sin(2 * np.pi * 500 * t).astype(np.float32)
+    blocks = x[:x.shape[0] // blocksize * blocksize].reshape(-1, blocksize)
+    return [partition_filters(w_k, blocksize) for w_k in w], blocks, fs // 4
+
+
+def test_switch_filters(blocksize=64, nblocks=16, threshold=1.5):
+    """Check that switching filters with crossfade does not click.
+
+    A sine is convolved with two random filter banks and the filters are
+    switched in the middle. The largest step between consecutive output
+    samples must stay below `threshold` times the largest step without
+    switching.
+    """
+    (W_a, W_b), blocks, nsample = _switch_test_signals(blocksize, 2)
+    nswitch = blocks.shape[0] // 2
+
+    y = {
+        'a': _run_switches(W_a, blocks, {}, nblocks),
+        'b': _run_switches(W_b, blocks, {}, nblocks),
+        'switch': _run_switches(W_a, blocks, {nswitch: W_b}, nblocks),
+    }
+
+    # steady state after the filter length
+    steady = slice(nsample, None)
+    max_step = max(np.abs(np.diff(y[k][:, steady])).max() for k in ('a', 'b'))
+    step = np.abs(np.diff(y['switch'][:, steady])).max()
+    assert step < threshold * max_step, f"switch causes a step of {step / max_step:.2f} times the largest step without switch"
+
+    # after the fade, the output equals the one of the new filters
+    after = slice((nswitch + nblocks) * blocksize, None)
+    assert np.allclose(y['switch'][:, after], y['b'][:, after], atol=1e-4)
+
+    return step / max_step
+
+
+def test_switch_filters_during_fade(blocksize=64, nblocks=16, threshold=1.5):
+    """Check that switching twice within one fade length does not click.
+
+    Like `test_switch_filters`, but the second switch comes half way through
+    the first fade.
+    """
+    (W_a, W_b, W_c), blocks, nsample = _switch_test_signals(blocksize, 3)
+    nswitch = blocks.shape[0] // 2
+    nswitch_again = nswitch + nblocks // 2
+
+    y = {
+        'a': _run_switches(W_a, blocks, {}, nblocks),
+        'b': _run_switches(W_b, blocks, {}, nblocks),
+        'c': _run_switches(W_c, blocks, {}, nblocks),
+        'switch': _run_switches(W_a, blocks, {nswitch: W_b, nswitch_again: W_c}, nblocks),
+    }
+
+    steady = slice(nsample, None)
+    max_step = max(np.abs(np.diff(y[k][:, steady])).max() for k in ('a', 'b', 'c'))
+    step = np.abs(np.diff(y['switch'][:, steady])).max()
+    assert step < threshold * max_step, f"switch causes a step of {step / max_step:.2f} times the largest step without switch"
+
+    # after the second fade, the output equals the one of the last filters
+    after = slice((nswitch_again + nblocks) * blocksize, None)
+    assert np.allclose(y['switch'][:, after], y['c'][:, after], atol=1e-4)
+
+    return step / max_step
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Render a headset recording through a lora filter bank',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('lora_filter', help='calibrated lora filter wav file or Ambisonic factorization npz file (see libownaura.ambisonic_filters)', type=Path)
+    parser.add_argument('recording', help='recording holding the headset microphone signal', type=Path)
+    parser.add_argument('-o', '--output', help='output file path. Default: recording name with lora filter name appended', type=Path, default=None)
+    parser.add_argument('-c', '--channel', help='channel index of the headset microphone in the recording', default=0, type=int)
+    parser.add_argument('-b', '--blocksize', help='block size of the partitioned convolution', default=1024, type=int, choices=BLOCKSIZES)
+
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = args.recording.with_name(f"{args.recording.stem}_{args.lora_filter.stem}.wav")
+
+    x, fs = sf.read(args.recording, dtype=np.float32, always_2d=True)
+    x = x[:, args.channel]
+
+    start = time.perf_counter()
+    if args.lora_filter.suffix == '.npz':
+        from libownaura.ambisonic_filters import load_factorization, AmbisonicRenderer
+        D, a, fs_filter = load_factorization(args.lora_filter)
+        convolver = AmbisonicRenderer(D, a, args.blocksize)
+    else:
+        fs_filter = sf.info(args.lora_filter).samplerate
+        convolver = UniformPartitionedConvolver.from_wav(args.lora_filter, args.blocksize)
+    assert fs_filter == fs, "recording and lora filter must have same samplerate"
+
+    render_to_file(convolver, x, args.output, fs)
+
+    elapsed = time.perf_counter() - start
+    print(f"Rendered {x.shape[0] / fs:.1f} s in {elapsed:.1f} s (real-time factor {elapsed * fs / x.shape[0]:.3f}).")
+    print(f"Saved `{args.output}`.")
@@ -1,18 +1,41 @@
 # %%
 
+import json
+import os
+import queue
+import threading
+import time
 import warnings
 import argparse
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import sounddevice as sd
 import numpy as np
 import matplotlib.pyplot as plt
 from response import Response
+from scipy.signal import fftconvolve
 from scipy.signal.windows import hann
 from tqdm import tqdm
 
+try:
+    import sounddevice as sd
+except (ImportError, OSError):  # OSError if the PortAudio library is missing
+    sd = None  # only a virtual device can be used, see `set_backend`
+
+
+def set_backend(backend):
+    """Use another audio backend than `sounddevice`.
+
+    The backend must provide `playrec`, `get_status`, `Stream` and `default`
+    like the `sounddevice` module, e.g. `libownaura.virtual_device.VirtualDevice`.
+    """
+    global sd
+    sd = backend
+
+
 def warn_on_streaming_error():
+    """Warn about under- and overflows of the last `playrec` and return True if there were any."""
     status = sd.get_status()
     if status.input_underflow:
         warnings.warn('Input underflow')
@@ -24,6 +47,7 @@ def warn_on_streaming_error():
         warnings.warn('output underflow')
     if status.priming_output:
         warnings.warn('Primed output')
+    return bool(status)
 
 
 def transfer_function(
@@ -92,6 +116,281 @@ def transfer_function(
         return H
 
 
+class Deconvolver:
+    """Deconvolve recordings of a fixed excitation signal.
+
+    The regularized inverse spectrum of the excitation is computed once, such
+    that each deconvolution needs only the FFT of the recording. Repetitions
+    are averaged before the deconvolution, which gives the same impulse
+    response as averaging the deconvolved repetitions.
+
+    Parameters
+    ----------
+    sound : ndarray, shape (nt,)
+        Excitation signal. Recordings must have the same length.
+    reg : float, optional
+        Regularization in deconvolution
+    reg_lim_dB: float, optional
+        Regularize such that reference has at least reg_lim_dB below of maximum energy
+        in each bin. Overwrites `reg` option.
+    inverse : ndarray, optional
+        Inverse filter of the excitation, e.g. from `farina_inverse_filter`.
+        Used instead of the regularized inverse spectrum.
+
+    """
+
+    TOO_LARGE_GAIN = 1e9
+
+    def __init__(self, sound, reg=0, reg_lim_dB=None, inverse=None):
+        self.nt = sound.shape[0]
+        R = np.fft.rfft(sound)
+        R[R == 0] = np.finfo(complex).eps  # avoid devision by zero
+        self.absR = np.abs(R)
+
+        if inverse is not None:
+            # advance the inverse filter by its length to start the impulse response at 0
+            k = np.arange(R.shape[0])
+            self.Rinv = np.fft.rfft(inverse, n=self.nt) * np.exp(2j * np.pi * k * (inverse.shape[0] - 1) / self.nt)
+
+            # normalize to unit gain where the excitation has energy
+            has_energy = self.absR > self.absR.max() * 1e-3
+            self.Rinv /= np.median(np.abs(R * self.Rinv)[has_energy])
+        else:
+            if reg_lim_dB is not None:
+                # power in reference should be at least reg_lim_dB below its maximum
+                minRdB = np.max(20 * np.log10(self.absR)) - reg_lim_dB
+                reg = 10 ** (minRdB / 10) - self.absR ** 2
+                reg[reg < 0] = 0
+
+            self.Rinv = R.conj() / (self.absR ** 2 + reg)
+
+    def deconvolve(self, rec):
+        """Impulse responses of recordings.
+
+        Parameters
+        ----------
+        rec : ndarray, shape (..., nt)
+            Recordings.
+
+        Returns
+        -------
+        ndarray, shape (..., nt)
+            Impulse responses.
+
+        """
+        Y = np.fft.rfft(rec, axis=-1)
+
+        # Avoid large TF gains that lead to Fourier Transform numerical errors
+        too_large = np.abs(Y) > self.TOO_LARGE_GAIN * self.absR
+        if np.any(too_large):
+            warnings.warn(
+                f"TF gains larger than {20*np.log10(self.TOO_LARGE_GAIN):.0f} dB. Setting to 0"
+            )
+            Y[too_large] = 0
+
+        return np.fft.irfft(Y * self.Rinv, n=self.nt, axis=-1)
+
+    def deconvolve_average(self, recs):
+        """Impulse responses averaged over repetitions.
+
+        Parameters
+        ----------
+        recs : ndarray, shape (..., nrep, nt)
+            Repeated recordings, e.g. of shape (nspeakers, nrep, nt).
+
+        Returns
+        -------
+        ndarray, shape (..., nt)
+            Impulse responses.
+
+        """
+        return self.deconvolve(np.mean(recs, axis=-2))
+
+
+def farina_inverse_filter(T, fs, f_start=None, f_end=None):
+    """Analytic inverse filter of `exponential_sweep` without fades.
+
+    The time reversed sweep with an amplitude that decreases by 6 dB per
+    octave, see `Farina`_ in `exponential_sweep`.
+    """
+    n_tap = int(np.round(T * fs))
+    if f_start is None:
+        f_start = fs / n_tap
+    if f_end is None:
+        f_end = fs / 2
+
+    sweep = exponential_sweep(T, fs, tfade=0, f_start=f_start, f_end=f_end)
+    t = np.arange(n_tap) / fs
+    return sweep[::-1] * np.exp(-t / T * np.log(f_end / f_start))
+
+
+class MeasurementQA:
+    """Check the quality of each loudspeaker right after its deconvolution.
+
+    A loudspeaker passes if
+
+    - the peak of its impulse response is at least `min_snr_dB` above the
+      noise in the last `tail` seconds of the impulse response, or in a
+      separate noise segment if given to `check`,
+    - the mean coherence of the repetitions over the frequencies of the
+      excitation is at least `min_coherence`,
+    - its peak delay differs by at most `max_delay_deviation_ms` from the
+      median peak delay of the passed loudspeakers among the `neighbours`
+      channels on each side,
+    - at most `max_xruns` callbacks had under- or overflows while recording it.
+
+    Can be called from several worker threads.
+
+    Parameters
+    ----------
+    fs : int
+        Samplerate.
+    deconvolver : Deconvolver
+        Deconvolver of the measurement, gives the frequencies of the excitation.
+
+    """
+
+    def __init__(self, fs, deconvolver, min_snr_dB=30, min_coherence=0.9, max_delay_deviation_ms=3, max_xruns=0, tail=0.1, neighbours=2):
+        self.fs = fs
+        self.has_energy = deconvolver.absR > deconvolver.absR.max() * 1e-3
+        self.min_snr_dB = min_snr_dB
+        self.min_coherence = min_coherence
+        self.max_delay_deviation_ms = max_delay_deviation_ms
+        self.max_xruns = max_xruns
+        self.ntail = int(tail * fs)
+        self.neighbours = neighbours
+        self.peaks = {}
+        self.lock = threading.Lock()
+
+    def tail_snr_dB(self, h, noise=None):
+        """Peak to noise ratio, with the noise in the tail of h or in noise if given."""
+        if noise is None or noise.size == 0:
+            noise = h[-self.ntail:]
+        return 10 * np.log10(np.max(h**2) / np.mean(noise**2))
+
+    def repetition_coherence(self, recs, has_energy=None):
+        """Mean magnitude squared coherence of repetitions of shape (nrep, nt).
+
+        Averaged over the frequencies where has_energy is True, by default
+        those of the excitation of the deconvolver.
+        """
+        if has_energy is None:
+            has_energy = self.has_energy
+        Y = np.fft.rfft(recs, axis=-1)[:, has_energy]
+        coherence = np.abs(np.sum(Y, axis=0))**2 / (Y.shape[0] * np.sum(np.abs(Y)**2, axis=0))
+        return np.mean(coherence)
+
+    def add_reference(self, out_ch, h):
+        """Use the peak of an impulse response as reference for the delay of its neighbours."""
+        with self.lock:
+            self.peaks[int(out_ch)] = int(np.argmax(np.abs(h)))
+
+    def delay_deviation_ms(self, out_ch, peak):
+        with self.lock:
+            neighbour_peaks = [
+                self.peaks[ch] for ch in range(out_ch - self.neighbours, out_ch + self.neighbours + 1)
+                if ch != out_ch and ch in self.peaks
+            ]
+        if not neighbour_peaks:
+            return 0.0
+        return abs(peak - np.median(neighbour_peaks)) / self.fs * 1000
+
+    def check(self, out_ch, h, recs=None, coherence=None, xruns=0, noise=None):
+        """Compute quality metrics of a loudspeaker and check thresholds.
+
+        Parameters
+        ----------
+        out_ch : int
+            Output channel.
+        h : ndarray, shape (nt,)
+            Impulse response.
+        recs : ndarray, shape (nrep, nt), optional
+            Recordings of the repetitions, for the coherence.
+        coherence : float, optional
+            Coherence of the repetitions, if computed already.
+        xruns : int, optional
+            Callbacks with under- or overflows while recording.
+        noise : ndarray, optional
+            Deconvolved noise without any impulse response, for the SNR.
+            Default: the tail of h.
+
+        Returns
+        -------
+        passed : bool
+            True if all metrics are within the thresholds.
+        metrics : dict
+            The metrics.
+
+        """
+        out_ch = int(out_ch)
+        if coherence is None:
+            coherence = self.repetition_coherence(recs) if recs is not None and recs.shape[0] > 1 else 1.0
+        peak = int(np.argmax(np.abs(h)))
+        metrics = {
+            'snr_dB': self.tail_snr_dB(h, noise),
+            'coherence': coherence,
+            'delay_deviation_ms': self.delay_deviation_ms(out_ch, peak),
+            'xruns': xruns,
+        }
+
+        failed = []
+        if metrics['snr_dB'] < self.min_snr_dB:
+            failed.append('snr')
+        if metrics['coherence'] < self.min_coherence:
+            failed.append('coherence')
+        if metrics['delay_deviation_ms'] > self.max_delay_deviation_ms:
+            failed.append('delay')
+        if metrics['xruns'] > self.max_xruns:
+            failed.append('xruns')
+
+        if failed:
+            tqdm.write(
+                f"Loudspeaker {out_ch} failed QA ({', '.join(failed)}): SNR {metrics['snr_dB']:.1f} dB, "
+                f"coherence {metrics['coherence']:.3f}, delay deviation {metrics['delay_deviation_ms']:.2f} ms, xruns {xruns}"
+            )
+        else:
+            self.add_reference(out_ch, h)
+
+        return not failed, metrics
+
+
+def record_single_impulse_response(
+    sound,
+    fs,
+    out_ch=1,
+    in_ch=1,
+    return_xruns=False,
+    **sd_kwargs,
+):
+    """Play sound at output channels and record input channels.
+
+    Returns
+    -------
+    ndarray, shape (nt, nin)
+        Recording
+    xruns : int
+        1 if there were under- or overflows, otherwise 0. Only returned if
+        `return_xruns` is True.
+
+    """
+    out_ch = np.atleast_1d(out_ch)
+    in_ch = np.atleast_1d(in_ch)
+
+    rec = sd.playrec(
+        sound,
+        samplerate=fs,
+        input_mapping=in_ch.copy(),     # make copies of mapping because of
+        output_mapping=out_ch.copy(),   # github.com/spatialaudio/python-sounddevice/issues/135
+        blocking=True,
+        **sd_kwargs,
+    )
+    xruns = int(warn_on_streaming_error())
+
+    if return_xruns:
+        return rec, xruns
+    return rec
+
+
 def measure_single_impulse_response(
     sound,
     fs,
@@ -118,21 +417,503 @@ def measure_single_impulse_response(
     ndarray, shape (nin, nt)
         Impulse response between output channel and input channels
 
+    """
+    rec = record_single_impulse_response(sound, fs, out_ch=out_ch, in_ch=in_ch, **sd_kwargs)
+    return transfer_function(sound[:, None], rec, axis=0, reg_lim_dB=reg_lim_dB).T
+
+
+def distortion_lead(T, fs, f_start=None, f_end=None, max_harmonic_order=3):
+    """Time in seconds by which harmonic distortion precedes the impulse response.
+
+    With an `exponential_sweep` of length T from f_start to f_end, the
+    impulse response of the k-th harmonic appears T ln(k) / ln(f_end / f_start)
+    before the linear impulse response, see `Farina`_ in `exponential_sweep`.
+    Returns this lead for k = max_harmonic_order.
+    """
+    n_tap = int(np.round(T * fs))
+    if f_start is None:
+        f_start = fs / n_tap
+    if f_end is None:
+        f_end = fs / 2
+    return T * np.log(max_harmonic_order) / np.log(f_end / f_start)
+
+
+def overlap_from_ir_length(ir_length, fs, sweep_time=1, f_start=None, f_end=None, max_harmonic_order=3, margin=None):
+    """Offset in samples between staggered sweeps for impulse responses of ir_length seconds.
+
+    The margin in seconds leaves room for the harmonic distortion products of
+    the next loudspeaker up to max_harmonic_order, which appear before its
+    impulse response. By default it is the `distortion_lead` of the sweep with
+    length sweep_time from f_start to f_end.
+    """
+    if margin is None:
+        margin = distortion_lead(sweep_time, fs, f_start=f_start, f_end=f_end, max_harmonic_order=max_harmonic_order)
+    return int(np.ceil((ir_length + margin) * fs))
+
+
+def multiple_sweep_signal(sweep, nout, offset):
+    """Stagger a sweep over nout loudspeakers.
+
+    Parameters
+    ----------
+    sweep : ndarray, shape (nt,)
+        Excitation signal.
+    nout : int
+        Number of loudspeakers.
+    offset : int
+        The sweep of each loudspeaker starts offset samples after the previous.
+
+    Returns
+    -------
+    ndarray, shape ((nout - 1) * offset + max(nt, offset), nout)
+        Excitation signal of each loudspeaker.
+
+    """
+    nt = sweep.shape[0]
+    sound = np.zeros(((nout - 1) * offset + max(nt, offset), nout))
+    for k in range(nout):
+        sound[k * offset : k * offset + nt, k] = sweep
+    return sound
+
+
+def deconvolve_multiple_sweeps(sweep, rec, nout, offset, reg_lim_dB=None, inverse=None, average=True, return_noise=False, distortion_margin=0):
+    """Separate the impulse responses of a recording of staggered sweeps.
+
+    The deconvolution with a single sweep gives the impulse responses of all
+    loudspeakers one after another, each delayed by offset samples. They are
+    separated by cutting windows of offset samples.
+
+    Parameters
+    ----------
+    sweep : ndarray, shape (nt,)
+        Excitation signal of a single loudspeaker.
+    rec : ndarray, shape (nrec,) or (nrep, nrec)
+        Recording of the signal of `multiple_sweep_signal`. Repetitions are
+        averaged before the deconvolution.
+    nout : int
+        Number of loudspeakers.
+    offset : int
+        Offset between sweeps in samples.
+    inverse : ndarray, optional
+        Inverse filter of the sweep, see `Deconvolver`.
+    average : bool, optional
+        If False, return the impulse responses of each repetition.
+    return_noise : bool, optional
+        If True, also return the deconvolution after the last impulse
+        response, which holds only noise.
+    distortion_margin : int, optional
+        Samples at the end of the deconvolution that hold the harmonic
+        distortion of the first loudspeaker and are not part of the noise,
+        see `distortion_lead`.
+
+    Returns
+    -------
+    ndarray, shape (nout, offset), or (nrep, nout, offset) if not average
+        Impulse response of each loudspeaker.
+    noise : ndarray, shape (nnoise,), or (nrep, nnoise) if not average
+        Noise segment, only returned if `return_noise` is True.
+
+    """
+    rec = np.atleast_2d(rec)
+    ref = np.zeros(rec.shape[-1])
+    ref[:sweep.shape[0]] = sweep
+    deconvolver = Deconvolver(ref, reg_lim_dB=reg_lim_dB, inverse=inverse)
+    if average:
+        h = deconvolver.deconvolve_average(rec)
+        shape = (nout, offset)
+    else:
+        h = deconvolver.deconvolve(rec)
+        shape = (-1, nout, offset)
+    h_out = h[..., :nout * offset].reshape(shape)
+    if return_noise:
+        return h_out, h[..., nout * offset:h.shape[-1] - distortion_margin]
+    return h_out
+
+
+def record_multiple_sweeps(
+    sweep,
+    fs,
+    offset,
+    out_ch,
+    in_ch=1,
+    return_xruns=False,
+    **sd_kwargs,
+):
+    """Play staggered sweeps at the output channels and record the input channel.
+
+    Returns
+    -------
+    ndarray, shape (nrec,)
+        Recording of the signal of `multiple_sweep_signal`.
+    xruns : int
+        1 if there were under- or overflows, otherwise 0. Only returned if
+        `return_xruns` is True.
+
     """
     out_ch = np.atleast_1d(out_ch)
-    in_ch = np.atleast_1d(in_ch)
+    sound = multiple_sweep_signal(sweep, len(out_ch), offset)
 
     rec = sd.playrec(
         sound,
         samplerate=fs,
-        input_mapping=in_ch.copy(),     # make copies of mapping because of
-        output_mapping=out_ch.copy(),   # github.com/spatialaudio/python-sounddevice/issues/135
+        input_mapping=[in_ch],
+        output_mapping=out_ch.copy(),
         blocking=True,
         **sd_kwargs,
     )
-    warn_on_streaming_error()
+    xruns = int(warn_on_streaming_error())
 
-    return transfer_function(sound[:, None], rec, axis=0, reg_lim_dB=reg_lim_dB).T
+    if return_xruns:
+        return rec[:, 0], xruns
+    return rec[:, 0]
+
+
+def measure_multiple_sweeps(
+    sweep,
+    fs,
+    offset,
+    out_ch,
+    in_ch=1,
+    reg_lim_dB=None,
+    inverse=None,
+    **sd_kwargs,
+):
+    """Measure impulse responses of several loudspeakers in one recording.
+
+    Uses the multiple exponential sweep method: the sweeps of the loudspeakers
+    are staggered by offset samples, which must be longer than the impulse
+    responses.
+
+    Parameters
+    ----------
+    sweep : ndarray, shape (nt,)
+        Excitation signal
+    fs : int
+        Sampling rate of sound
+    offset : int
+        Offset between sweeps in samples, see `overlap_from_ir_length`.
+    out_ch : list of length nout
+        Output channels
+    in_ch : int, optional
+        Input channel
+    inverse : ndarray, optional
+        Inverse filter of the sweep, e.g. from `farina_inverse_filter`, see
+        `Deconvolver`.
+
+    Returns
+    -------
+    ndarray, shape (nout, offset)
+        Impulse response between each output channel and the input channel
+
+    """
+    rec = record_multiple_sweeps(sweep, fs, offset, out_ch, in_ch=in_ch, **sd_kwargs)
+    return deconvolve_multiple_sweeps(sweep, rec, len(np.atleast_1d(out_ch)), offset, reg_lim_dB=reg_lim_dB, inverse=inverse)
+
+
+def test_multiple_sweeps(nout=64, fs=48000, ir_length=0.2, snr_dB=60, distortion_dB=None):
+    """Measure a simulated AVIL with staggered sweeps and compare to its responses.
+
+    With distortion_dB, the loudspeakers have a second order nonlinearity
+    of that level. The distortion of the next loudspeaker must then not
+    increase the error of a loudspeaker compared to the last one, which has
+    no next loudspeaker.
+    """
+    rng = np.random.default_rng(0)
+    nh = int(ir_length * fs)
+    h_true = rng.standard_normal((nout, nh)) * np.exp(-np.arange(nh) / (0.03 * fs))
+    h_true[:, :100] = 0  # propagation delay
+
+    x = exponential_sweep(1, fs, post_silence=0.3, tfade=0)
+    offset = overlap_from_ir_length(ir_length, fs, sweep_time=1)
+    sound = multiple_sweep_signal(x, nout, offset)
+    if distortion_dB is not None:
+        sound = sound + 10**(distortion_dB / 20) * sound**2
+
+    # recording of the sum of all loudspeakers plus noise
+    rec = np.sum(fftconvolve(sound.T, h_true, axes=-1), axis=0)[:sound.shape[0]]
+    rec += rng.standard_normal(rec.shape) * np.std(rec) * 10**(-snr_dB / 20)
+
+    h = deconvolve_multiple_sweeps(x, rec, nout, offset)
+
+    error_dB = 10 * np.log10(np.sum((h[:, :nh] - h_true)**2, axis=-1) / np.sum(h_true**2, axis=-1))
+    print(f"{nout} loudspeakers in {sound.shape[0] / fs:.1f} s instead of {nout * x.shape[0] / fs:.1f} s")
+    print(f"Relative error: {error_dB.max():.1f} dB at worst")
+    if distortion_dB is not None:
+        print(f"Relative error of the last loudspeaker: {error_dB[-1]:.1f} dB")
+        assert error_dB.max() < error_dB[-1] + 1, "distortion of the next loudspeaker leaks into the impulse responses"
+    return error_dB
+
+
+class PipelinedMeasurement:
+    """Measure loudspeakers one after another on a continuously running stream.
+
+    The excitation of all loudspeakers and repetitions is played back to back
+    from the callback of a duplex stream. As soon as all repetitions of a
+    loudspeaker are recorded, they are deconvolved and averaged in a worker
+    thread while the stream continues with the next loudspeaker, so the audio
+    interface never waits for the FFTs.
+
+    Parameters
+    ----------
+    sound : ndarray, shape (nt,)
+        Excitation signal, including the silence after it.
+    out_chs : list of length nout
+        Output channels, starting at 1.
+    in_ch : int
+        Input channel, starting at 1.
+    nrepetitions : int
+        Number of repetitions per loudspeaker.
+    stream_factory : callable
+        Called as `stream_factory(callback=..., channels=..., blocksize=...)`
+        to create the stream, e.g. `sounddevice.Stream` or
+        `libownaura.virtual_device.FakeStream`.
+    workers : int, optional
+        Number of worker threads.
+    blocksize : int, optional
+        Frames per callback.
+    reg_lim_dB : float, optional
+        Regularization of the deconvolution, see `Deconvolver`.
+    inverse : ndarray, optional
+        Inverse filter of the excitation, see `Deconvolver`.
+    on_result : callable, optional
+        Called as `on_result(out_ch, h, passed, metrics)` from the worker
+        thread as soon as a loudspeaker is processed, e.g. to save a
+        checkpoint. Without qa, passed is True and metrics is None.
+    qa : MeasurementQA, optional
+        Quality check of each loudspeaker. Failed loudspeakers are listed in
+        `failed` after `run`.
+
+    """
+
+    def __init__(self, sound, out_chs, in_ch, nrepetitions, stream_factory, workers=4, blocksize=1024, reg_lim_dB=None, inverse=None, on_result=None, qa=None):
+        self.sound = sound.astype(np.float32)
+        self.nt = sound.shape[0]
+        self.out_chs = np.atleast_1d(out_chs)
+        self.in_ch = in_ch
+        self.nrepetitions = nrepetitions
+        self.stream_factory = stream_factory
+        self.workers = workers
+        self.blocksize = blocksize
+        self.deconvolver = Deconvolver(sound, reg_lim_dB=reg_lim_dB, inverse=inverse)
+        self.on_result = on_result
+        self.qa = qa
+        self.failed = []
+
+        self.nframes = len(self.out_chs) * nrepetitions * self.nt
+        self.recordings = np.zeros((len(self.out_chs), nrepetitions, self.nt), dtype=np.float32)
+        self.played = 0
+        self.recorded = 0
+        self.xruns = 0
+        self.speaker_xruns = np.zeros(len(self.out_chs), dtype=int)
+        self.completed = queue.Queue()
+        self.error = None
+
+    def callback(self, indata, outdata, frames, time, status):
+        """Stream callback, plays the next frames of the excitation and stores the recording.
+
+        An exception aborts the stream and is raised again by `run`.
+        """
+        try:
+            self._callback(indata, outdata, frames, status)
+        except Exception as e:
+            self.error = e
+            raise
+
+    def _callback(self, indata, outdata, frames, status):
+        if status:
+            self.xruns += 1
+            self.speaker_xruns[min(self.recorded // (self.nrepetitions * self.nt), len(self.out_chs) - 1)] += 1
+
+        # play, loudspeaker after loudspeaker and repetition after repetition
+        outdata.fill(0)
+        i = 0
+        while i < frames and self.played < self.nframes:
+            job, offset = divmod(self.played, self.nt)
+            n = min(frames - i, self.nt - offset)
+            outdata[i:i + n, self.out_chs[job // self.nrepetitions] - 1] = self.sound[offset:offset + n]
+            i += n
+            self.played += n
+
+        # record
+        n = min(frames, self.nframes - self.recorded)
+        if n > 0:
+            self.recordings.reshape(-1)[self.recorded:self.recorded + n] = indata[:n, self.in_ch - 1]
+            completed_before = self.recorded // (self.nrepetitions * self.nt)
+            self.recorded += n
+            for speaker in range(completed_before, self.recorded // (self.nrepetitions * self.nt)):
+                self.completed.put(speaker)
+
+    def process(self, speaker):
+        """Average the repetitions of a loudspeaker and deconvolve."""
+        out_ch = self.out_chs[speaker]
+        h = self.deconvolver.deconvolve_average(self.recordings[speaker])
+
+        passed, metrics = True, None
+        if self.qa is not None:
+            passed, metrics = self.qa.check(out_ch, h, recs=self.recordings[speaker], xruns=self.speaker_xruns[speaker])
+            if not passed:
+                self.failed.append(out_ch)
+
+        if self.on_result is not None:
+            self.on_result(out_ch, h, passed, metrics)
+        return h
+
+    def wait_for_speaker(self, stream, poll_interval=0.5):
+        """Return the next recorded loudspeaker, or raise if the stream stopped before."""
+        while True:
+            try:
+                return self.completed.get(timeout=poll_interval)
+            except queue.Empty:
+                if self.error is not None:
+                    raise RuntimeError('stream callback failed') from self.error
+                if not stream.active:
+                    raise RuntimeError(f'stream stopped after {self.recorded} of {self.nframes} frames')
+
+    def run(self):
+        """Measure all loudspeakers.
+
+        Returns
+        -------
+        ndarray, shape (nout, nt)
+            Impulse response between each output channel and the input channel
+
+        Raises
+        ------
+        RuntimeError
+            If the stream stops or the callback fails before all loudspeakers
+            are recorded.
+
+        """
+        h = np.zeros((len(self.out_chs), self.nt))
+        futures = {}
+        stream = self.stream_factory(callback=self.callback, channels=(self.in_ch, self.out_chs.max()), blocksize=self.blocksize)
+        with ThreadPoolExecutor(self.workers) as executor:
+            with stream:
+                for _ in tqdm(range(len(self.out_chs)), desc='Loudspeaker', leave=False):
+                    speaker = self.wait_for_speaker(stream)
+                    futures[speaker] = executor.submit(self.process, speaker)
+
+            for speaker, future in futures.items():
+                h[speaker] = future.result()
+
+        if self.xruns:
+            warnings.warn(f'{self.xruns} callbacks with input or output under- or overflow')
+
+        return h
+
+
+def test_pipelined_measurement(nout=8, fs=48000, nrepetitions=2):
+    """Measure a virtual AVIL with `PipelinedMeasurement` and compare to its responses."""
+    from libownaura.virtual_device import FakeStream
+
+    rng = np.random.default_rng(0)
+    x = exponential_sweep(0.5, fs, post_silence=0.3, tfade=0)
+    nh = int(0.2 * fs)
+    h_true = rng.standard_normal((nout, nh)) * np.exp(-np.arange(nh) / (0.03 * fs))
+
+    # the virtual room responds only at input channel 2
+    h_room = np.zeros((2, nout, nh))
+    h_room[1] = h_true
+
+    def stream_factory(callback, channels, blocksize):
+        return FakeStream(h_room, fs, blocksize, callback, channels=channels)
+
+    measurement = PipelinedMeasurement(x, np.arange(1, nout + 1), 2, nrepetitions, stream_factory, blocksize=256)
+    h = measurement.run()
+
+    # the fake stream has a latency of one block
+    h = h[:, 256:256 + nh]
+    error_dB = 10 * np.log10(np.sum((h - h_true)**2, axis=-1) / np.sum(h_true**2, axis=-1))
+    print(f"Relative error: {error_dB.max():.1f} dB at worst")
+    return error_dB
+
+
+def checkpoint_file(checkpoint_dir, out_ch):
+    return checkpoint_dir / f'speaker_{out_ch:03d}.npy'
+
+
+def checkpoint_qa_file(checkpoint_dir, out_ch):
+    return checkpoint_dir / f'speaker_{out_ch:03d}.json'
+
+
+def save_checkpoint(checkpoint_dir, out_ch, h, passed=True, metrics=None):
+    """Save impulse response of a loudspeaker as soon as it is measured.
+
+    The QA status and metrics are saved next to it, such that loudspeakers
+    that failed QA are measured again on resume.
+    """
+    # the QA status first, a checkpoint without it is not valid
+    qa_path = checkpoint_qa_file(checkpoint_dir, out_ch)
+    tmp = qa_path.with_name(qa_path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump({'passed': bool(passed), 'metrics': metrics}, f, default=lambda value: value.item())
+    os.replace(tmp, qa_path)
+
+    path = checkpoint_file(checkpoint_dir, out_ch)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, h)
+    os.replace(tmp, path)
+
+
+def load_checkpoint_qa(checkpoint_dir, out_ch):
+    """QA status and metrics of a checkpoint as saved by `save_checkpoint`, or None."""
+    path = checkpoint_qa_file(checkpoint_dir, out_ch)
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def prepare_checkpoint_dir(checkpoint_dir, x, resume, **metadata):
+    """Create checkpoint folder, or check that it belongs to the same measurement on resume.
+
+    The excitation signal x and the metadata, e.g. the measurement mode, the
+    impulse response length and fs, are stored with the checkpoints. Resuming
+    requires the same excitation and metadata.
+    """
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    excitation_file = checkpoint_dir / 'excitation.npy'
+    metadata_file = checkpoint_dir / 'metadata.json'
+    if excitation_file.exists():
+        if not resume:
+            raise FileExistsError(f'{checkpoint_dir} holds a previous measurement. Use --resume or remove it.')
+        if not np.array_equal(np.load(excitation_file), x):
+            raise ValueError(f'{checkpoint_dir} holds a measurement with a different excitation signal.')
+        if not metadata_file.exists():
+            raise ValueError(f'{checkpoint_dir} has no {metadata_file.name}, cannot check that it holds the same kind of measurement.')
+        with open(metadata_file) as f:
+            saved = json.load(f)
+        differ = {key: (saved.get(key), value) for key, value in metadata.items() if saved.get(key) != value}
+        if differ:
+            raise ValueError(
+                f'{checkpoint_dir} holds a different measurement: '
+                + ', '.join(f'{key} {old} instead of {new}' for key, (old, new) in differ.items())
+            )
+    else:
+        with open(metadata_file, 'w') as f:
+            json.dump(metadata, f)
+        np.save(excitation_file, x)
+
+
+def missing_speakers(checkpoint_dir, out_chs):
+    """Output channels without a valid checkpoint that passed QA."""
+    missing = []
+    for out_ch in out_chs:
+        path = checkpoint_file(checkpoint_dir, out_ch)
+        qa = load_checkpoint_qa(checkpoint_dir, out_ch)
+        if not path.exists() or qa is None or not qa['passed'] or not np.all(np.isfinite(np.load(path))):
+            missing.append(out_ch)
+    return np.array(missing, dtype=int)
+
+
+def assemble_checkpoints(checkpoint_dir, out_chs):
+    """Load the impulse responses of all loudspeakers into one array of shape (nout, nt)."""
+    nt = np.load(checkpoint_file(checkpoint_dir, out_chs[0]), mmap_mode='r').shape[-1]
+    h = np.empty((len(out_chs), nt))
+    for i, out_ch in enumerate(out_chs):
+        h[i] = np.load(checkpoint_file(checkpoint_dir, out_ch))
+    return h
 
 
 def exponential_sweep(
@@ -213,12 +994,44 @@ if __name__ == '__main__':
     parser.add_argument('-m', '--max-amp', help='max amplitude of excitation signal', default=0.03, type=float)
     parser.add_argument('-i', '--input-channel', help='index of input channel', default=7, type=int)
     parser.add_argument('-N', '--nout', help='number of loudspeakers to measure', default=64, type=int)
+    parser.add_argument('-s', '--multiple-sweeps', metavar='IR_LENGTH', help='measure all loudspeakers in one recording with sweeps staggered by the expected impulse response length IR_LENGTH in seconds', default=None, type=float)
+    parser.add_argument('--max-harmonic-order', help='leave room for harmonic distortion up to this order between multiple sweeps', default=3, type=int)
+    parser.add_argument('--pipelined', help='play and record on a continuous stream and deconvolve in the background', default=False, action='store_true')
+    parser.add_argument('-j', '--workers', help='number of worker threads for deconvolution in pipelined measurement', default=4, type=int)
+    parser.add_argument('--farina-inverse', help='deconvolve with the analytic inverse filter of the sweep instead of the regularized inverse spectrum', default=False, action='store_true')
+    parser.add_argument('-c', '--checkpoint-dir', help='folder for the impulse response of each loudspeaker as soon as it is measured. Default: output path with `_checkpoints` appended', default=None, type=pathlib.Path)
+    parser.add_argument('-r', '--resume', help='measure only loudspeakers without checkpoint or that failed QA. Needs the same output path or checkpoint folder as the interrupted run', default=False, action='store_true')
+    parser.add_argument('--min-snr', help='QA: minimum peak to tail noise ratio of an impulse response in dB', default=30, type=float)
+    parser.add_argument('--min-coherence', help='QA: minimum mean coherence of the repetitions', default=0.9, type=float)
+    parser.add_argument('--max-delay-deviation', help='QA: maximum deviation of the peak delay from neighbouring loudspeakers in ms', default=3, type=float)
+    parser.add_argument('--max-xruns', help='QA: maximum number of under- or overflows while recording a loudspeaker', default=0, type=int)
+    parser.add_argument('--max-retries', help='re-measure loudspeakers that fail QA at most this many times', default=2, type=int)
+    parser.add_argument('--virtual', metavar='H_AVIL', help='measure a virtual AVIL instead of the RedNet device, either `synthetic` or an h_avil npz file', default=None)
+    parser.add_argument('--virtual-noise', help='standard deviation of noise at the virtual microphone', default=1e-5, type=float)
+    parser.add_argument('--virtual-latency', help='latency of the virtual device in samples', default=0, type=int)
+    parser.add_argument('--virtual-xruns', help='probability of an xrun in each block of the virtual device', default=0, type=float)
+    parser.add_argument('--virtual-realtime', help='let the virtual device take as long as the audio', default=False, action='store_true')
     parser.add_argument('-d', '--debug', help='turn on plotting', default=False, action='store_true')
 
     args = parser.parse_args()
 
     # device setup
     fs = 48000
+    if args.virtual is not None:
+        from libownaura.virtual_device import VirtualDevice, synthetic_h_avil
+
+        if args.virtual == 'synthetic':
+            h_virtual = synthetic_h_avil(args.nout, fs)
+        else:
+            with np.load(args.virtual) as data:
+                assert data['fs'] == fs
+                h_virtual = data['h'][:args.nout]
+        set_backend(VirtualDevice(
+            h_virtual, args.input_channel, noise_level=args.virtual_noise, latency=args.virtual_latency,
+            xrun_probability=args.virtual_xruns, realtime=args.virtual_realtime
+        ))
+    elif sd is None:
+        raise RuntimeError('sounddevice with the PortAudio library is needed to measure. Use --virtual to measure a virtual AVIL.')
     sd.default.device = 'RedNet PCIe'
     sd.default.samplerate = fs
     sd.default.latency = ('low', 'low')
@@ -227,15 +1040,123 @@ if __name__ == '__main__':
     # compute sweep signal
     x = exponential_sweep(args.sweep_time, fs, post_silence=args.post_silence, tfade=0) * args.max_amp;
 
-    # measure every loudspeaker
-    h = []
-    for out_ch in tqdm(out_chs, desc='Loudspeaker', leave=False):
-        # average over repetitions
-        h_avg = 0
-        for i in range(args.nrepetitions):
-            h_avg += measure_single_impulse_response(x, fs, out_ch=out_ch, in_ch=args.input_channel)[0] / args.nrepetitions
-        h.append(h_avg)
-    h = np.stack(h)
+    inverse = farina_inverse_filter(args.sweep_time, fs) / args.max_amp if args.farina_inverse else None
+
+    start = time.perf_counter()
+
+    # checkpoints
+    checkpoint_dir = args.checkpoint_dir or args.output.with_name(args.output.name + '_checkpoints')
+    if args.multiple_sweeps is not None:
+        mode = 'multiple-sweeps'
+    elif args.pipelined:
+        mode = 'pipelined'
+    else:
+        mode = 'sequential'
+    prepare_checkpoint_dir(checkpoint_dir, x, args.resume, mode=mode, ir_length=args.multiple_sweeps, fs=fs)
+    todo = missing_speakers(checkpoint_dir, out_chs)
+    print(f'Measuring {len(todo)} of {len(out_chs)} loudspeakers, checkpoints in {checkpoint_dir}')
+
+    # quality check of each loudspeaker, failed loudspeakers are measured again
+    deconvolver = Deconvolver(x, inverse=inverse)
+    qa = MeasurementQA(
+        fs, deconvolver, min_snr_dB=args.min_snr, min_coherence=args.min_coherence,
+        max_delay_deviation_ms=args.max_delay_deviation, max_xruns=args.max_xruns
+    )
+    # loudspeakers measured before a resume are the reference for the delays of their neighbours
+    for out_ch in np.setdiff1d(out_chs, todo):
+        qa.add_reference(out_ch, np.load(checkpoint_file(checkpoint_dir, out_ch)))
+
+    for attempt in range(args.max_retries + 1):
+        if len(todo) == 0:
+            break
+        if attempt > 0:
+            print(f'Measuring {len(todo)} loudspeakers again that failed QA: {todo}')
+
+        # on the last attempt keep the measurements even if they fail
+        keep_failed = attempt == args.max_retries
+        failed = []
+
+        if args.multiple_sweeps is not None:
+            # measure all loudspeakers at once
+            offset = overlap_from_ir_length(args.multiple_sweeps, fs, sweep_time=args.sweep_time, max_harmonic_order=args.max_harmonic_order)
+            recs, xruns = zip(*[
+                record_multiple_sweeps(x, fs, offset, todo, in_ch=args.input_channel, return_xruns=True)
+                for i in tqdm(range(args.nrepetitions), desc='Repetition', leave=False)
+            ])
+            # an xrun corrupts all loudspeakers whose sweeps overlap it, count it for all
+            xruns = sum(xruns)
+            # the tail of each impulse response holds the distortion of the next loudspeaker,
+            # estimate the noise after the last impulse response instead
+            distortion_margin = int(np.ceil(distortion_lead(args.sweep_time, fs, max_harmonic_order=args.max_harmonic_order) * fs))
+            h_reps, noise_reps = deconvolve_multiple_sweeps(
+                x, np.stack(recs), len(todo), offset, inverse=inverse, average=False,
+                return_noise=True, distortion_margin=distortion_margin
+            )
+            h_todo = h_reps.mean(axis=0)
+            noise = noise_reps.mean(axis=0)
+            if noise.shape[0] < qa.ntail:
+                warnings.warn(f'Only {noise.shape[0]} samples of noise after the last impulse response for the SNR. Increase --post-silence.')
+
+            # coherence of the repetitions in the window of each loudspeaker, at the frequencies of the sweep
+            R = np.abs(np.fft.rfft(x))
+            has_energy = np.interp(
+                np.fft.rfftfreq(offset), np.fft.rfftfreq(x.shape[0]), (R > R.max() * 1e-3).astype(float)
+            ) > 0.5
+            for k, (out_ch, h_out_ch) in enumerate(zip(todo, h_todo)):
+                coherence = qa.repetition_coherence(h_reps[:, k], has_energy) if args.nrepetitions > 1 else 1.0
+                passed, metrics = qa.check(out_ch, h_out_ch, coherence=coherence, xruns=xruns, noise=noise)
+                if not passed:
+                    failed.append(out_ch)
+                if passed or keep_failed:
+                    save_checkpoint(checkpoint_dir, out_ch, h_out_ch, passed, metrics)
+        elif args.pipelined:
+            def stream_factory(**kwargs):
+                return sd.Stream(**kwargs)
+
+            def on_result(out_ch, h_out_ch, passed, metrics):
+                if passed or keep_failed:
+                    save_checkpoint(checkpoint_dir, out_ch, h_out_ch, passed, metrics)
+
+            measurement = PipelinedMeasurement(
+                x, todo, args.input_channel, args.nrepetitions, stream_factory,
+                workers=args.workers, inverse=inverse, on_result=on_result, qa=qa
+            )
+            measurement.run()
+            failed = sorted(measurement.failed)
+        else:
+            # measure every loudspeaker
+            for out_ch in tqdm(todo, desc='Loudspeaker', leave=False):
+                # average over repetitions before deconvolution
+                recs, xruns = zip(*[
+                    record_single_impulse_response(x, fs, out_ch=out_ch, in_ch=args.input_channel, return_xruns=True)
+                    for i in range(args.nrepetitions)
+                ])
+                recs = np.stack([rec[:, 0] for rec in recs])
+                h_out_ch = deconvolver.deconvolve_average(recs)
+                passed, metrics = qa.check(out_ch, h_out_ch, recs=recs, xruns=sum(xruns))
+                if not passed:
+                    failed.append(out_ch)
+                if passed or keep_failed:
+                    save_checkpoint(checkpoint_dir, out_ch, h_out_ch, passed, metrics)
+
+        todo = np.array(failed, dtype=int)
+
+    if len(todo) > 0:
+        warnings.warn(
+            f'Loudspeakers {todo} failed QA after {args.max_retries} retries, kept last measurement. '
+            'They are marked as failed in the checkpoints and measured again with --resume.'
+        )
+
+    h = assemble_checkpoints(checkpoint_dir, out_chs)
+    print(f'Measured in {time.perf_counter() - start:.1f} s')
+
+    if args.virtual is not None:
+        # compare to the virtual AVIL, aligned by the latency of the measurement incl. the stream buffer
+        lag = int(np.median(np.argmax(np.abs(h), axis=-1) - np.argmax(np.abs(h_virtual), axis=-1)))
+        n = min(h.shape[1] - lag, h_virtual.shape[1])
+        h_measured = h[:, lag:lag + n]
+        error_dB = 10 * np.log10(np.sum((h_measured - h_virtual[:, :n])**2, axis=-1) / np.sum(h_virtual[:, :n]**2, axis=-1))
+        print(f'Latency {lag} samples, relative error to virtual AVIL: {error_dB.max():.1f} dB at worst (loudspeaker {out_chs[error_dB.argmax()]})')
 
     # save
     np.savez(str(args.output), h=h, fs=fs, x=x)
@@ -1,5 +1,8 @@
 # %%
 import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 from matplotlib import pyplot as plt
@@ -8,7 +11,9 @@ import matplotlib.pyplot as plt
 import soundfile as sf
 
 from response import Response
+from libownaura.cache import DEFAULT_CACHE_DIR, Cache, cached
 from libownaura.compute_calibration_filter import compute_H_direct_avil
+from libownaura.streaming import OverlapAddFilter
 from scipy.signal import flattop, lfilter
 
 DEBUG = True
@@ -19,6 +24,13 @@ headset_channel_calibration_recording = 2
 measmic_channel_convolver_recording = 0
 headset_channel_convolver_recording = 1
 
+OUTPUT_SUFFIX = "_sound pressure at 1m.wav"
+
+# set in each worker by `init_worker`
+worker_calibrator_gain = None
+worker_ir_headset_measmic = None
+worker_blocksize = None
+
 
 def amplitude_spectrum(x, axis=-1, norm=True):
     """Convert time domain signal to single sided amplitude spectrum.
@@ -120,6 +132,160 @@ def headset_to_sound_pressure(x, calibrator_gain, ir_headset_measmic):
     return x
 
 
+def sound_pressure_level(energy, nsamples):
+    """SPL in dB of a signal in Pa from its energy, i.e. the sum of squares."""
+    return 10*np.log10(energy/nsamples/(20e-6)**2)
+
+
+def convert_recording(f, newfilename, calibrator_gain, ir_headset_measmic):
+    """Convert a 2 channel convolver recording to sound pressure and return the SPL of the measmic."""
+    x, fs = sf.read(f)
+    if x.ndim != 2 or x.shape[1] != 2:
+        raise ValueError(f"{f} has {1 if x.ndim == 1 else x.shape[1]} channels, can only calibrate 2channel recordings made with the convolver patch")
+
+    if DEBUG:
+        plt.figure()
+        plt.title("file to be compesanted")
+        plt.plot(x[:, measmic_channel_convolver_recording] * calibrator_gain, label="calibrator signal after calibration")
+        plt.plot(x[:, measmic_channel_convolver_recording], label="calibrator signal before calibration")
+        plt.legend()
+        plt.show()
+
+    x[:, headset_channel_convolver_recording] = headset_to_sound_pressure(x[:, headset_channel_convolver_recording], calibrator_gain, ir_headset_measmic)
+    x[:, measmic_channel_convolver_recording] *= calibrator_gain
+
+    sf.write(newfilename, x, fs, format="WAV", subtype="FLOAT")
+
+    xn, fs = sf.read(newfilename)
+    return sound_pressure_level(np.sum(xn[:, measmic_channel_convolver_recording]**2), len(xn))
+
+
+def convert_recording_streaming(f, newfilename, calibrator_gain, ir_headset_measmic, blocksize):
+    """Convert a recording block by block, see `convert_recording`.
+
+    The headset channel is filtered by FFT overlap-add with the state carried
+    between blocks, each block is written as soon as it is converted and the
+    SPL is accumulated on the way, such that memory use does not depend on the
+    length of the recording and the output is not read again.
+    """
+    info = sf.info(f)
+    if info.channels != 2:
+        raise ValueError(f"{f} has {info.channels} channels, can only calibrate 2channel recordings made with the convolver patch")
+
+    ola = OverlapAddFilter(ir_headset_measmic, blocksize)
+    energy = 0
+    nsamples = 0
+
+    with sf.SoundFile(newfilename, 'w', samplerate=info.samplerate, channels=info.channels, format="WAV", subtype="FLOAT") as out:
+        for x in sf.blocks(f, blocksize=blocksize, always_2d=True):
+            x = x * calibrator_gain
+            x[:, headset_channel_convolver_recording] = ola.process(x[None, :, headset_channel_convolver_recording])[0]
+            out.write(x)
+
+            energy += np.sum(x[:, measmic_channel_convolver_recording]**2)
+            nsamples += len(x)
+
+    return sound_pressure_level(energy, nsamples)
+
+
+def output_filename(f):
+    return str(Path(f).with_suffix("")) + OUTPUT_SUFFIX
+
+
+def find_recordings(paths, exclude=()):
+    """Expand folders to the wav and aif recordings in them.
+
+    Converted files and the files in exclude, e.g. the calibration
+    recordings, are skipped when expanding folders.
+    """
+    exclude = {Path(x).resolve() for x in exclude}
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files += sorted(
+                str(x) for x in path.iterdir()
+                if x.suffix.lower() in (".wav", ".aif", ".aiff") and not x.name.endswith(OUTPUT_SUFFIX)
+                and x.resolve() not in exclude
+            )
+        else:
+            files.append(str(path))
+    return files
+
+
+def init_worker(calibrator_gain, ir_headset_measmic, blocksize, debug=False):
+    global DEBUG, worker_calibrator_gain, worker_ir_headset_measmic, worker_blocksize
+    DEBUG = debug
+    worker_calibrator_gain = calibrator_gain
+    worker_ir_headset_measmic = ir_headset_measmic
+    worker_blocksize = blocksize
+
+
+def convert_file(f):
+    """Convert one recording with the calibration of this worker.
+
+    Returns
+    -------
+    newfilename : str
+    spl : float
+        SPL of the measmic in dB.
+    duration : float
+        Length of the recording in seconds.
+
+    """
+    newfilename = output_filename(f)
+    if worker_blocksize is not None:
+        spl = convert_recording_streaming(f, newfilename, worker_calibrator_gain, worker_ir_headset_measmic, worker_blocksize)
+    else:
+        spl = convert_recording(f, newfilename, worker_calibrator_gain, worker_ir_headset_measmic)
+    return newfilename, spl, sf.info(f).duration
+
+
+def report_failed(failed):
+    if failed:
+        print(f"Could not convert {len(failed)} files:")
+        for f, e in failed.items():
+            print(f"  {f}: {e!r}")
+
+
+def convert_files(files, calibrator_gain, ir_headset_measmic, blocksize=None, workers=None):
+    """Convert recordings in a process pool and print the progress.
+
+    The calibration is passed once to each worker, not with every file. A
+    file that cannot be converted is reported and the others are converted
+    anyway.
+
+    Returns
+    -------
+    spls : dict
+        SPL of the measmic in dB for each converted file.
+    failed : dict
+        Error for each file that could not be converted.
+
+    """
+    start = time.perf_counter()
+    spls = {}
+    failed = {}
+    total_duration = 0
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(calibrator_gain, ir_headset_measmic, blocksize)) as executor:
+        jobs = {executor.submit(convert_file, f): f for f in files}
+        for i, job in enumerate(as_completed(jobs), 1):
+            f = jobs[job]
+            try:
+                newfilename, spl, duration = job.result()
+            except Exception as e:
+                failed[f] = e
+                print(f"[{i}/{len(files)}] failed {f}: {e!r}")
+                continue
+            spls[f] = spl
+            total_duration += duration
+            print(f"[{i}/{len(files)}] saved {newfilename}, {spl:.1f} dB")
+
+    elapsed = time.perf_counter() - start
+    print(f"Converted {len(spls)} files with {total_duration / 60:.1f} min of audio in {elapsed:.1f} s ({total_duration / elapsed:.0f}x real time)")
+    report_failed(failed)
+    return spls, failed
+
+
 # %%
 def test():
     calibrator_recording = "M:\\OwnAura\\Data\\measurement_microphone_SPLcalibration_recording.wav"
@@ -160,41 +326,63 @@ if __name__ == "__main__":
         help='recording of headset and measurement microphone, e.g. "calibration_recording.aif"',
     )
     parser.add_argument(
-        "files", nargs='+', help='files to convert'
+        "files", nargs='+', help='files or session folders to convert'
     )
     parser.add_argument(
         "--debug", action="store_true", help="turn on debug plotting", default=False
     )
+    parser.add_argument(
+        "-j", "--workers", help="number of worker processes. 0 for number of processors", default=1, type=int
+    )
+    parser.add_argument(
+        "-b", "--blocksize", help="stream the recordings in blocks of this many samples to bound memory use", default=None, type=int
+    )
+    parser.add_argument(
+        "--cache-dir", help="folder of the cache of intermediate results", type=Path, default=DEFAULT_CACHE_DIR
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="compute all intermediate results, do not use or fill the cache", default=False
+    )
 
     args = parser.parse_args()
     DEBUG = args.debug
+    if args.workers == 0:
+        args.workers = None
+    if args.blocksize is not None and DEBUG:
+        print("Debug plots are not available when streaming.")
 
     if Path(args.measmic_calibrator_recording).suffix != ".aif":
             raise ValueError("Use original aif file!")
 
     print("Computing calibration gains and filters")
     calibrator_gain = calibrator_gain_from_calibrator_recording(args.measmic_calibrator_recording)
-    ir_headset_measmic = compute_H_direct_avil(args.headset_measmic_calibration_recording, reg=10e-14, constrained=True, window_length=1024)
-
-    for f in args.files:
-        print("Processing ", f, "...")
-        x, fs = sf.read(f)
-        assert x.shape[1] == 2, "Can only calibrate 2channel recordings made with the convolver patch"
+    cache = None if args.no_cache else Cache(args.cache_dir)
+    ir_headset_measmic = cached(
+        cache, 'h_direct_avil',
+        lambda: compute_H_direct_avil(args.headset_measmic_calibration_recording, reg=10e-14, constrained=True, window_length=1024),
+        files=[args.headset_measmic_calibration_recording], fs=48000, reg=10e-14, window_length=1024,
+        headset_ch=1, measmic_ch=0, constrained=True
+    )
 
+    files = find_recordings(args.files, exclude=[args.measmic_calibrator_recording, args.headset_measmic_calibration_recording])
+    if args.workers == 1:
+        init_worker(calibrator_gain, ir_headset_measmic, args.blocksize, debug=DEBUG)
+        failed = {}
+        for f in files:
+            print("Processing ", f, "...")
+            try:
+                newfilename, spl, _ = convert_file(f)
+            except Exception as e:
+                failed[f] = e
+                print("failed ", repr(e))
+                continue
+            print(spl)
+            print("saved ", newfilename)
+        report_failed(failed)
+    else:
         if DEBUG:
-            plt.figure()
-            plt.title("file to be compesanted")
-            plt.plot(x[:, measmic_channel_convolver_recording] * calibrator_gain, label="calibrator signal after calibration")
-            plt.plot(x[:, measmic_channel_convolver_recording], label="calibrator signal before calibration")
-            plt.legend()
-            plt.show()
-
-        x[:, headset_channel_convolver_recording] = headset_to_sound_pressure(x[:, headset_channel_convolver_recording], calibrator_gain, ir_headset_measmic)
-        x[:, measmic_channel_convolver_recording] *= calibrator_gain
-
-        newfilename = str(Path(f).with_suffix("")) + "_sound pressure at 1m.wav"
-        sf.write(newfilename, x, fs, format="WAV", subtype="FLOAT")
-
-        xn, fs = sf.read(newfilename)
-        print(10*np.log10(np.sum(xn[:, measmic_channel_convolver_recording]**2)/len(xn[:, measmic_channel_convolver_recording])/(20e-6)**2))
-        print("saved ", newfilename)
\ No newline at end of file
+            print("Debug plots are not available with several workers.")
+        print(f"Processing {len(files)} files")
+        _, failed = convert_files(files, calibrator_gain, ir_headset_measmic, blocksize=args.blocksize, workers=args.workers)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,104 @@
+"""Render one headset recording through the filters of every room.
+
+The spectra of the partitioned input are computed and padded once and shared
+between all rooms, only the filter spectra differ.
+
+Example
+-------
+Render the headset channel of a recording through all calibrated filters in
+the current folder and save the loudspeaker sum of each room
+
+    python -m libownaura.render_rooms recording.wav -c 1 --monitor
+
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from libownaura.convolver import BLOCKSIZES, UniformPartitionedConvolver, pad_input_spectra, partition_input, render_to_file
+
+
+def render_rooms(x, fs, lora_filters, output_folder, blocksize, monitor=False, prefix=''):
+    """Render x through each filter bank in lora_filters.
+
+    Parameters
+    ----------
+    x : ndarray, shape (nt,)
+        Input signal.
+    fs : int
+        Samplerate.
+    lora_filters : list of Path
+        Lora filter wav files, one per room.
+    output_folder : Path
+        Folder for the output files, named after the filter files.
+    blocksize : int
+        Block size of the partitioned convolution.
+    monitor : bool, optional
+        If True, save only the sum over all loudspeakers.
+    prefix : str, optional
+        Prepended to the names of the output files.
+
+    Returns
+    -------
+    list of Path
+        Output files.
+
+    """
+    infos = [sf.info(str(f)) for f in lora_filters]
+    for f, info in zip(lora_filters, infos):
+        assert info.samplerate == fs, f"recording (fs={fs}) and {f} (fs={info.samplerate}) must have same samplerate"
+
+    # input spectra long enough for the longest filters
+    nsample = max(info.frames for info in infos)
+    nblocks = -(-(x.shape[0] + nsample - 1) // blocksize)
+    xpad = np.zeros(nblocks * blocksize, dtype=x.dtype)
+    xpad[:x.shape[0]] = x
+    # silent blocks for the partitions of the longest filters
+    npad = -(-nsample // blocksize) - 1
+    X = pad_input_spectra(partition_input(xpad, blocksize), npad)
+
+    outfiles = []
+    for lora_filter in lora_filters:
+        start = time.perf_counter()
+        outfile = output_folder / (prefix + lora_filter.stem + ('_monitor.wav' if monitor else '.wav'))
+        w, _ = sf.read(str(lora_filter), dtype=np.float32)
+        w = w.T  # shape (nch, nsample)
+        if monitor:
+            # the sum of all outputs is the convolution with the sum of all filters
+            w = w.sum(axis=0, keepdims=True)
+        convolver = UniformPartitionedConvolver.from_filters(w, blocksize)
+        render_to_file(convolver, x, outfile, fs, X=X, npad=npad)
+        print(f"Rendered {lora_filter.stem} in {time.perf_counter() - start:.1f} s to `{outfile}`.")
+        outfiles.append(outfile)
+
+    return outfiles
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Render a headset recording through the lora filters of all rooms',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('recording', help='recording holding the headset microphone signal', type=Path)
+    parser.add_argument('-l', '--lora_filter_folder', help='the folder holding the calibrated lora filters', default='.', type=Path)
+    parser.add_argument('-g', '--glob', help='pattern of lora filter files in the folder', default='*_calibrated.wav')
+    parser.add_argument('-o', '--output_folder', help='folder to save output', default='.', type=Path)
+    parser.add_argument('-c', '--channel', help='channel index of the headset microphone in the recording', default=0, type=int)
+    parser.add_argument('-b', '--blocksize', help='block size of the partitioned convolution', default=1024, type=int, choices=BLOCKSIZES)
+    parser.add_argument('-m', '--monitor', help='save only the sum over all loudspeakers', action='store_true')
+
+    args = parser.parse_args()
+
+    lora_filters = sorted(args.lora_filter_folder.glob(args.glob))
+    if not lora_filters:
+        raise Exception(f'Could not find any lora filters matching {args.glob} in {args.lora_filter_folder}. Check path!')
+
+    x, fs = sf.read(args.recording, dtype=np.float32, always_2d=True)
+    x = x[:, args.channel]
+
+    args.output_folder.mkdir(parents=True, exist_ok=True)
+    render_rooms(x, fs, lora_filters, args.output_folder, args.blocksize, monitor=args.monitor, prefix=args.recording.stem + '_')
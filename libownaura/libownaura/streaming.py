@@ -0,0 +1,175 @@
+"""Block-wise filtering of long multichannel signals."""
+
+import warnings
+
+import numpy as np
+import scipy.fft
+import scipy.signal
+from numpy.lib.stride_tricks import as_strided
+
+
+def sliding_windows(x, n, step=1):
+    """Read-only view of the windows of n samples every step samples along the last axis.
+
+    Like `numpy.lib.stride_tricks.sliding_window_view` followed by slicing
+    with step, which needs numpy 1.20.
+
+    Returns
+    -------
+    ndarray, shape (..., (x.shape[-1] - n) // step + 1, n)
+
+    """
+    nwin = max(0, (x.shape[-1] - n) // step + 1)
+    return as_strided(
+        x, shape=x.shape[:-1] + (nwin, n), strides=x.strides[:-1] + (x.strides[-1] * step, x.strides[-1]), writeable=False
+    )
+
+
+class OverlapAddFilter:
+    """Convolve a multichannel signal block by block with one impulse response.
+
+    Uses FFT based overlap-add. The convolution tail of each block is carried
+    over to the next call of `process`, such that concatenating the outputs of
+    all calls followed by `flush` equals the full convolution of the signal.
+
+    Parameters
+    ----------
+    h : ndarray, shape (M,)
+        Impulse response.
+    blocksize : int
+        Maximum number of samples per block passed to `process`.
+    nch : int, optional
+        Number of channels.
+
+    """
+
+    def __init__(self, h, blocksize, nch=1):
+        self.blocksize = blocksize
+        self.nh = h.shape[0]
+        self.nfft = scipy.fft.next_fast_len(blocksize + self.nh - 1, real=True)
+        self.H = scipy.fft.rfft(h, n=self.nfft)
+        self.tail = np.zeros((nch, self.nh - 1))
+
+    def process(self, x):
+        """Filter next block.
+
+        Parameters
+        ----------
+        x : ndarray, shape (nch, n)
+            Block of input signal with `n <= blocksize`.
+
+        Returns
+        -------
+        ndarray, shape (nch, n)
+            Block of output signal.
+
+        """
+        n = x.shape[-1]
+        assert n <= self.blocksize, f"block has {n} samples but blocksize is {self.blocksize}"
+
+        y = scipy.fft.irfft(scipy.fft.rfft(x, n=self.nfft, axis=-1) * self.H, n=self.nfft, axis=-1)
+        y = y[:, :n + self.nh - 1]
+        y[:, :self.nh - 1] += self.tail
+        self.tail = y[:, n:].copy()
+
+        return y[:, :n]
+
+    def process_blocks(self, blocks):
+        """Filter an iterable of blocks and finally yield the convolution tail."""
+        for x in blocks:
+            yield self.process(x)
+        yield self.flush()
+
+    def flush(self):
+        """Return the remaining convolution tail and reset the state."""
+        tail = self.tail
+        self.tail = np.zeros_like(tail)
+        return tail
+
+
+class WelchEstimator:
+    """Estimate the cross spectral matrix of a multichannel signal block by block with Welch's method.
+
+    All channels are segmented and transformed once, giving the auto and cross
+    power spectral densities of all channel pairs together. The segments
+    overlap across the boundaries of the blocks passed to `process`, such that
+    the result equals `scipy.signal.welch` and `scipy.signal.csd` with
+    `return_onesided=False` and the default Hann window, 50 % overlap and
+    constant detrending. Only the samples of the last incomplete segment are
+    kept between calls. Like scipy, a signal shorter than `nperseg` is
+    estimated from one segment of its full length, with a warning.
+
+    Parameters
+    ----------
+    nperseg : int
+        Length of each segment.
+    fs : int
+        Samplerate.
+    nch : int, optional
+        Number of channels.
+
+    """
+
+    def __init__(self, nperseg, fs, nch=2):
+        self.fs = fs
+        self.buffer = np.zeros((nch, 0))
+        self._set_nperseg(nperseg)
+
+    def _set_nperseg(self, nperseg):
+        nch = self.buffer.shape[0]
+        self.nperseg = nperseg
+        self.step = nperseg - nperseg // 2
+        self.window = scipy.signal.get_window('hann', nperseg)
+        self.scale = 1 / (self.fs * np.sum(self.window**2))
+        self.S = np.zeros((nch, nch, nperseg), dtype=complex)
+        self.nseg = 0
+
+    def process(self, x):
+        """Add the segments of the next block.
+
+        Parameters
+        ----------
+        x : ndarray, shape (nch, n)
+            Block of signal, of any length.
+
+        """
+        buffer = np.concatenate((self.buffer, x), axis=-1)
+
+        nseg = max(0, (buffer.shape[-1] - self.nperseg) // self.step + 1)
+        if nseg > 0:
+            segments = sliding_windows(buffer, self.nperseg, self.step)[:, :nseg]
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+            X = scipy.fft.fft(segments * self.window, axis=-1)
+            self.S += np.einsum('isk,jsk->ijk', X.conj(), X)
+            self.nseg += nseg
+
+        self.buffer = buffer[:, nseg * self.step:].copy()
+
+    def spectral_matrix(self):
+        """Return frequencies f and two-sided cross spectral matrix S, shape (nch, nch, nperseg).
+
+        `S[i, j]` is the cross power spectral density of channel i and j.
+        """
+        if self.nseg == 0:
+            # all samples are still in the buffer
+            n = self.buffer.shape[-1]
+            assert n > 0, "no samples processed"
+            warnings.warn(f"nperseg = {self.nperseg} is greater than input length = {n}, using nperseg = {n}")
+            buffer = self.buffer
+            self.buffer = np.zeros((buffer.shape[0], 0))
+            self._set_nperseg(n)
+            self.process(buffer)
+        f = scipy.fft.fftfreq(self.nperseg, 1 / self.fs)
+        return f, self.S * self.scale / self.nseg
+
+    def spectra(self, x_ch=0, y_ch=1):
+        """Return frequencies f and two-sided Sxx, Syy and Sxy of two channels."""
+        f, S = self.spectral_matrix()
+        return f, S[x_ch, x_ch].real, S[y_ch, y_ch].real, S[x_ch, y_ch]
+
+    def coherence(self, x_ch=0, y_ch=1):
+        """Return positive frequencies f and magnitude squared coherence Cxy of two channels."""
+        _, Sxx, Syy, Sxy = self.spectra(x_ch, y_ch)
+        nf = self.nperseg // 2 + 1
+        f = scipy.fft.rfftfreq(self.nperseg, 1 / self.fs)
+        return f, np.abs(Sxy[:nf])**2 / Sxx[:nf] / Syy[:nf]
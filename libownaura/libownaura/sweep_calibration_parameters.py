@@ -0,0 +1,220 @@
+"""Evaluate calibration filters for grids of parameters in one pass.
+
+Counterpart of `compute_calibration_filter` for tuning its parameters. The
+expensive intermediate results are computed once and shared by all
+combinations:
+
+- the AVIL response to the reference lora filters, h_current,
+- the target response H_R / H_D,
+- the Welch spectra of the calibration recording for each window length, from
+  one read of the recording,
+- the spectra of the reference lora filters.
+
+The combinations of `--window_length`, `--reg_H_direct_avil` and `--reg_C`
+are then evaluated in a process pool for all `--filter-length`. The shared
+arrays are sent to each worker once. For each combination the error of the filter in octave bands,
+the energy cut from the calibrated reference filters and the delay in samples
+are printed, and optionally saved as csv.
+
+Example
+-------
+    python -m libownaura.sweep_calibration_parameters calibration_recording.aif --reg_C 1e-10 1e-8 --window_length 512 1024 --filter-length 255 511 1023
+
+"""
+
+import argparse
+import functools
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.fft
+
+from libownaura.cache import DEFAULT_CACHE_DIR, Cache, cached
+from libownaura.compute_calibration_filter import (BAND_CENTER_FREQS, OWNAURA_PATH, average_over_bands, band_errors,
+                                                   compute_calibration_gain, compute_delay, compute_H_R_H_D,
+                                                   design_minimum_phase_filter, fs, load_H_avil, load_W_ref,
+                                                   predict_avil_response, welch_estimators_from_file,
+                                                   wiener_filter_from_spectra)
+
+# set in each worker by `init_worker`
+W_ref = None
+nfft = None
+h_R_h_D_shared = None
+h_current_shared = None
+spectra_shared = None
+
+
+def init_worker(W, n, h_R_h_D, h_current, spectra):
+    global W_ref, nfft, h_R_h_D_shared, h_current_shared, spectra_shared
+    W_ref = W
+    nfft = n
+    h_R_h_D_shared = h_R_h_D
+    h_current_shared = h_current
+    spectra_shared = spectra
+    target_response.cache_clear()
+
+
+def cut_energy(h, n):
+    """Fraction of energy cut from the reference lora filters calibrated with h and n."""
+    if n <= 0:
+        return 0.0
+    w_cal = scipy.fft.irfft(W_ref * scipy.fft.rfft(h, n=nfft), n=nfft, axis=-1)
+    energy = np.sum(w_cal**2)
+    return np.sum(w_cal[:, :n]**2) / energy
+
+
+@functools.lru_cache(maxsize=None)
+def target_response(window_length, reg_H):
+    """Target response and delay for one window length and reg_H, computed once per worker."""
+    f, Sxx, Sxy = spectra_shared[window_length]
+    h_direct_avil = wiener_filter_from_spectra(f, Sxx, Sxy, reg=reg_H, constrained=True)
+    h_target = np.convolve(h_R_h_D_shared, h_direct_avil)
+    return h_target, compute_delay(h_target, h_current_shared)
+
+
+def evaluate(window_length, reg_H, reg_C, filter_lengths):
+    """Evaluate all filter lengths for one combination of window length, reg_H and reg_C."""
+    h_target, delay_samples = target_response(window_length, reg_H)
+    calibration_gain, nsamples = compute_calibration_gain(h_target, h_current_shared, reg_C)
+    band_gains = tuple(average_over_bands(calibration_gain, nsamples).tolist())
+
+    rows = []
+    for M in filter_lengths:
+        _, h = design_minimum_phase_filter(M, band_gains)
+        errors = band_errors(h, band_gains, nsamples)
+        rows.append({
+            'window_length': window_length,
+            'reg_H_direct_avil': reg_H,
+            'reg_C': reg_C,
+            'filter_length': M,
+            'max_error_dB': np.max(np.abs(errors)),
+            **{f'error_{f}Hz_dB': e for f, e in zip(BAND_CENTER_FREQS[1:-1], errors)},
+            'cut_energy_percent': cut_energy(h, delay_samples) * 100,
+            'delay_samples': delay_samples,
+        })
+
+    return rows
+
+
+def sweep(h_R_h_D, h_current, w_ref, estimators, reg_Hs, reg_Cs, filter_lengths, workers=None):
+    """Evaluate calibration for all combinations of parameters.
+
+    The shared arrays are sent once to each worker process. Each worker
+    estimates h_direct_avil and the delay for a window length and reg_H
+    only once and reuses them for all values of reg_C.
+
+    Parameters
+    ----------
+    h_R_h_D : ndarray
+        Target ratio of reflected to direct sound.
+    h_current : ndarray
+        AVIL response to the reference lora filters.
+    w_ref : ndarray, shape (nch, nsample)
+        Reference lora filters.
+    estimators : dict
+        `WelchEstimator` of the calibration recording for each window length.
+    reg_Hs, reg_Cs, filter_lengths : list
+        Values of the regularization of h_direct_avil, the regularization of
+        the calibration gain and the filter length.
+    workers : int, optional
+        Number of worker processes.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per combination.
+
+    """
+    # long enough for the longest calibration filter and any delay
+    nfft_ref = scipy.fft.next_fast_len(w_ref.shape[1] + max(filter_lengths) - 1, real=True)
+    W = scipy.fft.rfft(w_ref, n=nfft_ref, axis=-1)
+
+    spectra = {}
+    for window_length, estimator in estimators.items():
+        f, Sxx, _, Sxy = estimator.spectra()
+        spectra[window_length] = (f, Sxx, Sxy)
+
+    # window length and reg_H vary slowest, so that consecutive jobs of a worker often share the target response
+    combinations = list(itertools.product(estimators, reg_Hs, reg_Cs))
+    initargs = (W, nfft_ref, h_R_h_D, h_current, spectra)
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=initargs) as executor:
+        jobs = [executor.submit(evaluate, *combination, filter_lengths) for combination in combinations]
+        rows = [row for job in jobs for row in job.result()]
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate calibration filters for grids of parameters",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "calibration_recording",
+        help='recording of headset and measurement microphone, e.g. "calibration_recording.aif"',
+    )
+    parser.add_argument("--measmic-ch", help='channel index of measurement microphone in recoding', default=0, type=int)
+    parser.add_argument("--headset-ch", help='channel index of headset microphone in recoding', default=1, type=int)
+    parser.add_argument("--filter-length", help="lengths of minimum_phase filter. Must be odd.", nargs='+', default=[511], type=int)
+    parser.add_argument("--reg_C", help="regularization parameters in gain estimation of calibration filter", nargs='+', default=[1e-10], type=float)
+    parser.add_argument("--reg_H_direct_avil", help="regularization parameters in estimation of H_{direct, avil}", nargs='+', default=[1e-14], type=float)
+    parser.add_argument("--window_length", help="window lengths in estimation of H_{direct, avil}", nargs='+', default=[512], type=int)
+    parser.add_argument("-j", "--workers", help="number of worker processes. Default: number of processors", default=None, type=int)
+    parser.add_argument("-o", "--output", help="save table as csv file", type=Path, default=None)
+    parser.add_argument(
+        "--h_avil_file",
+        help="file path to AVIL impulse responses",
+        type=Path,
+        default=OWNAURA_PATH / "h_avil_2022-01-20T15-57-38.npz"
+    )
+    parser.add_argument(
+        "--lora_ir_reference_file",
+        help="path to impulse response from lora for reference room",
+        type=Path,
+        default=OWNAURA_PATH / "Lora filters/Calibration room.wav"
+    )
+    parser.add_argument(
+        "--early_reflections_file",
+        help="path to early reflections from Odeon for reference room",
+        type=Path,
+        default=OWNAURA_PATH / "Odeon rooms/Calibration room/AVIL implementation files/10_10_10m_sketchupbase.Job01.00001EarlyReflections.Txt"
+    )
+    parser.add_argument("--cache-dir", help="folder of the cache of intermediate results", type=Path, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true", help="compute all intermediate results, do not use or fill the cache", default=False)
+
+    args = parser.parse_args()
+
+    if any(M % 2 == 0 for M in args.filter_length):
+        raise ValueError("Filter lengths must be odd.")
+
+    cache = None if args.no_cache else Cache(args.cache_dir)
+
+    print("Computing target response H_R / H_D")
+    h_R_h_D = cached(
+        cache, 'h_R_h_D', lambda: compute_H_R_H_D(str(args.early_reflections_file)),
+        files=[args.early_reflections_file], fs=fs
+    )
+
+    print("Computing avil response to odeon reference filter")
+    w_ref = load_W_ref(str(args.lora_ir_reference_file))
+    h_current = cached(
+        cache, 'h_current', lambda: predict_avil_response(load_H_avil(str(args.h_avil_file)), w_ref),
+        files=[args.h_avil_file, args.lora_ir_reference_file], fs=fs
+    )
+
+    print(f"Computing spectra of calibration recording for window lengths {args.window_length}")
+    estimators = welch_estimators_from_file(args.calibration_recording, args.window_length, [args.headset_ch, args.measmic_ch])
+
+    ncombinations = len(args.window_length) * len(args.reg_H_direct_avil) * len(args.reg_C) * len(args.filter_length)
+    print(f"Evaluating {ncombinations} combinations")
+    table = sweep(h_R_h_D, h_current, w_ref, estimators, args.reg_H_direct_avil, args.reg_C, args.filter_length, workers=args.workers)
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None, 'display.float_format', '{:.3g}'.format):
+        print(table)
+
+    if args.output is not None:
+        table.to_csv(args.output, index=False)
+        print(f"Saved table to {args.output}")
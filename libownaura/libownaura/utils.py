@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import re
 import numpy as np
 
@@ -6,6 +7,8 @@ from scipy.signal import correlate, coherence
 from response import Response
 from ast import literal_eval
 
+from libownaura.streaming import WelchEstimator
+
 def time_align(x, y, fs, trange=None):
     """Time align two signals, zeropad as necessary.
 
@@ -39,7 +42,7 @@ def time_align(x, y, fs, trange=None):
     return x, y, dt
 
 
-def coherence_csd(x, y, fs, compensate_delay=True, **csd_kwargs):
+def coherence_csd(x, y, fs, compensate_delay=True, nperseg=256, **csd_kwargs):
     """Estimate maginitude squared coherence of two signals using Welch's method.
 
     Parameters
@@ -50,8 +53,12 @@ def coherence_csd(x, y, fs, compensate_delay=True, **csd_kwargs):
         Sampling frequency
     compensate_delay: optional, bool
         Compensate for delays in correlation estimations.
+    nperseg: optional, int
+        Length of each segment.
     **csd_kwargs
-        Kwargs are fed to csd and welch functions.
+        Kwargs are fed to csd and welch functions. Without, the spectra are
+        estimated with `WelchEstimator`, which gives the same result for the
+        default hann window, overlap and detrending.
 
     Returns
     -------
@@ -68,7 +75,12 @@ def coherence_csd(x, y, fs, compensate_delay=True, **csd_kwargs):
     if compensate_delay:
         x, y, _ = time_align(x, y, fs)
 
-    f, Cxy = coherence(x, y, fs=fs, **csd_kwargs)
+    if csd_kwargs:
+        f, Cxy = coherence(x, y, fs=fs, nperseg=nperseg, **csd_kwargs)
+    else:
+        estimator = WelchEstimator(nperseg, fs)
+        estimator.process(np.stack((x, y)))
+        f, Cxy = estimator.coherence()
 
     return f, Cxy
 
@@ -79,6 +91,15 @@ def find_nearest(array, value):
     return array[idx], idx
 
 
+def file_hash(path, chunksize=2**20):
+    """Compute sha256 hex digest of a file's content."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def time_window_type(arg_value, pat=re.compile(r"\(\(\d*\.\d+|\d+,\d*\.\d+|\d+\),\(\d*\.\d+|\d+,\d*\.\d+|\d+\)\)")):
     if not pat.match(arg_value):
         raise argparse.ArgumentTypeError
@@ -0,0 +1,335 @@
+"""Simulated audio device for testing measurements without the RedNet hardware.
+
+`FakeStream` mimics the callback interface of `sounddevice.Stream`. The played
+output channels are convolved with the impulse responses of a virtual room,
+e.g. a previously measured `h_avil`, and their sum is passed to the callback as
+recorded input.
+
+`VirtualDevice` can replace the `sounddevice` module as audio backend of
+`measure_avil_impulse_responses`, see `set_backend` there. It simulates a
+virtual AVIL with noise, latency and optional xruns, both for blocking
+`playrec` and for callback streams.
+
+Example
+-------
+Measure a synthetic AVIL end to end
+
+    python -m libownaura.measure_avil_impulse_responses --virtual synthetic --virtual-noise 1e-5 --virtual-latency 256
+
+"""
+
+import threading
+import time
+import types
+
+import numpy as np
+import scipy.fft
+
+
+class PortAudioError(Exception):
+    """Raised by the virtual device where `sounddevice` raises `sounddevice.PortAudioError`."""
+
+
+class FakeCallbackFlags:
+    """Status passed to the callback, like `sounddevice.CallbackFlags`."""
+
+    def __init__(self):
+        self.input_underflow = False
+        self.input_overflow = False
+        self.output_underflow = False
+        self.output_overflow = False
+        self.priming_output = False
+
+    def __bool__(self):
+        return any((self.input_underflow, self.input_overflow, self.output_underflow, self.output_overflow, self.priming_output))
+
+
+class VirtualRoom:
+    """Block-wise convolution of output channels with impulse responses to input channels.
+
+    Parameters
+    ----------
+    h : ndarray, shape (nin, nout, nh)
+        Impulse response from each output to each input channel.
+    blocksize : int
+        Maximum number of frames per block.
+
+    """
+
+    def __init__(self, h, blocksize):
+        self.nin, self.nout, self.nh = h.shape
+        self.blocksize = blocksize
+        self.nfft = scipy.fft.next_fast_len(blocksize + self.nh - 1, real=True)
+        self.H = scipy.fft.rfft(h, n=self.nfft, axis=-1)
+        self.tail = np.zeros((self.nin, self.nh - 1))
+
+    def process(self, outdata):
+        """Return the input of shape (frames, nin) for the output of shape (frames, nout)."""
+        n = outdata.shape[0]
+        X = scipy.fft.rfft(outdata.T, n=self.nfft, axis=-1)
+        y = scipy.fft.irfft(np.einsum('iok,ok->ik', self.H, X), n=self.nfft, axis=-1)[:, :n + self.nh - 1]
+        y[:, :self.nh - 1] += self.tail
+        self.tail = y[:, n:].copy()
+        return y[:, :n].T
+
+
+class FakeStream:
+    """Duplex stream on a virtual room with the interface of `sounddevice.Stream`.
+
+    The callback is called from a background thread with the input that
+    results from the output of the previous call, i.e. with a latency of one
+    block plus `latency` frames.
+
+    Parameters
+    ----------
+    h : ndarray, shape (nin, nout, nh)
+        Impulse responses of the virtual room.
+    samplerate : int
+        Samplerate, only used in real-time mode.
+    blocksize : int
+        Frames per callback.
+    callback : callable
+        Called as `callback(indata, outdata, frames, time, status)`.
+    finished_callback : callable, optional
+        Called without arguments after the stream stopped.
+    realtime : bool, optional
+        If True, call the callback at the pace of the samplerate. Otherwise
+        as fast as possible.
+    noise_level : float, optional
+        Standard deviation of white noise added to the input.
+    latency : int, optional
+        Additional delay of the input in frames.
+    xrun_probability : float, optional
+        Probability that a callback loses its input block and reports an
+        input overflow.
+    input_channels : list of int, optional
+        Input channel of the stream for each of the nin room inputs, starting
+        at 1. Default: the first nin channels.
+    channels : int or (int, int), optional
+        Number of input and output channels of the stream. Room inputs on
+        higher input channels are not recorded and only the first output
+        channels are played. Default: enough channels for all room inputs
+        and outputs.
+    seed : int, optional
+        Seed of noise and xruns.
+
+    """
+
+    def __init__(self, h, samplerate, blocksize, callback, finished_callback=None, realtime=False, dtype=np.float32,
+                 noise_level=0, latency=0, xrun_probability=0, input_channels=None, channels=None, seed=0):
+        if input_channels is None:
+            input_channels = np.arange(1, h.shape[0] + 1)
+        input_channels = np.asarray(input_channels)
+        if channels is None:
+            channels = (input_channels.max(), h.shape[1])
+        self.channels = tuple(int(c) for c in np.broadcast_to(channels, 2))
+        self.room = VirtualRoom(h[:, :self.channels[1]], blocksize)
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.input_channels = input_channels
+        self.callback = callback
+        self.finished_callback = finished_callback
+        self.realtime = realtime
+        self.dtype = dtype
+        self.noise_level = noise_level
+        self.latency = latency
+        self.xrun_probability = xrun_probability
+        self.rng = np.random.default_rng(seed)
+        self.active = False
+        self._thread = None
+
+    def _run(self):
+        indata = np.zeros((self.blocksize, self.channels[0]), dtype=self.dtype)
+        outdata = np.zeros((self.blocksize, self.channels[1]), dtype=self.dtype)
+        status = FakeCallbackFlags()
+        pending = np.zeros((self.latency, self.room.nin))  # delay line of the input
+        start = time.perf_counter()
+        nblocks = 0
+        while self.active:
+            outdata.fill(0)
+            try:
+                self.callback(indata, outdata, self.blocksize, None, status)
+            except Exception:
+                # like sounddevice, an exception in the callback aborts the stream
+                self.active = False
+                if self.finished_callback is not None:
+                    self.finished_callback()
+                raise
+
+            pending = np.concatenate((pending, self.room.process(outdata)))
+            block, pending = pending[:self.blocksize], pending[self.blocksize:]
+
+            indata = np.zeros_like(indata)
+            recorded = self.input_channels <= self.channels[0]
+            indata[:, self.input_channels[recorded] - 1] = block[:, recorded]
+            if self.noise_level:
+                indata += self.noise_level * self.rng.standard_normal(indata.shape)
+
+            status = FakeCallbackFlags()
+            if self.rng.random() < self.xrun_probability:
+                status.input_overflow = True
+                indata.fill(0)
+
+            nblocks += 1
+            if self.realtime:
+                time.sleep(max(0, start + nblocks * self.blocksize / self.samplerate - time.perf_counter()))
+
+        if self.finished_callback is not None:
+            self.finished_callback()
+
+    def start(self):
+        self.active = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.active = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def synthetic_h_avil(nout, fs, T=0.3, seed=0):
+    """Impulse responses of a virtual AVIL.
+
+    Each loudspeaker has a direct sound after a random distance of 1.5 to
+    2.5 m and exponentially decaying noise as reverberation.
+
+    Returns
+    -------
+    ndarray, shape (nout, round(T * fs))
+
+    """
+    rng = np.random.default_rng(seed)
+    nh = int(round(T * fs))
+    h = 0.05 * rng.standard_normal((nout, nh)) * np.exp(-np.arange(nh) / (0.02 * fs))
+    delays = np.round(rng.uniform(1.5, 2.5, nout) / 343 * fs).astype(int)
+    for k, delay in enumerate(delays):
+        h[k, :delay] = 0
+        h[k, delay] = 1
+    return h
+
+
+class VirtualDevice:
+    """Audio backend with the interface of the `sounddevice` module on a virtual AVIL.
+
+    Provides `playrec`, `get_status`, `Stream` and `default`, such that it
+    can replace `sounddevice` in `measure_avil_impulse_responses`.
+
+    Parameters
+    ----------
+    h_avil : ndarray, shape (nout, nh)
+        Impulse responses from each loudspeaker to the microphone.
+    in_ch : int
+        Input channel of the microphone, starting at 1.
+    noise_level : float, optional
+        Standard deviation of white noise added to the input.
+    latency : int, optional
+        Delay of the input in frames.
+    xrun_probability : float, optional
+        Probability that a block of `blocksize` frames is lost and reported
+        as input overflow.
+    realtime : bool, optional
+        If True, take as long as the audio, like a real device.
+    blocksize : int, optional
+        Block size of xruns and of the `playrec` simulation.
+    max_input_channels : int, optional
+        Number of input channels of the device. Default: in_ch. The device
+        has one output channel per loudspeaker.
+    seed : int, optional
+        Seed of noise and xruns.
+
+    """
+
+    PortAudioError = PortAudioError
+
+    def __init__(self, h_avil, in_ch, noise_level=0, latency=0, xrun_probability=0, realtime=False, blocksize=1024,
+                 max_input_channels=None, seed=0):
+        self.h = h_avil[None]  # shape (1, nout, nh)
+        self.in_ch = in_ch
+        self.max_input_channels = in_ch if max_input_channels is None else max_input_channels
+        self.max_output_channels = h_avil.shape[0]
+        if not 1 <= in_ch <= self.max_input_channels:
+            raise ValueError(f"input channel {in_ch} is not one of the {self.max_input_channels} input channels")
+        self.noise_level = noise_level
+        self.latency = latency
+        self.xrun_probability = xrun_probability
+        self.realtime = realtime
+        self.blocksize = blocksize
+        self.rng = np.random.default_rng(seed)
+        self.status = FakeCallbackFlags()
+        self.default = types.SimpleNamespace(device=None, samplerate=None, latency=None)
+
+    def _check_channels(self, nin, nout, what):
+        """Raise like PortAudio if the device does not have nin input and nout output channels."""
+        if not (0 <= nin <= self.max_input_channels and 0 <= nout <= self.max_output_channels):
+            raise PortAudioError(
+                f"Error opening {what}: Invalid number of channels [PaErrorCode -9998]: "
+                f"requested {nin} inputs and {nout} outputs, the virtual device has "
+                f"{self.max_input_channels} inputs and {self.max_output_channels} outputs"
+            )
+
+    def get_status(self):
+        """Status of the last `playrec`."""
+        return self.status
+
+    def playrec(self, data, samplerate=None, input_mapping=None, output_mapping=None, blocking=True, **kwargs):
+        """Play data at output_mapping and record input_mapping, like `sounddevice.playrec`."""
+        data = np.asarray(data, dtype=float)
+        if data.ndim == 1:
+            data = data[:, None]
+        nt = data.shape[0]
+        samplerate = samplerate or self.default.samplerate
+
+        input_mapping = np.atleast_1d(input_mapping)
+        output_mapping = np.atleast_1d(output_mapping)
+        self._check_channels(input_mapping.max(), output_mapping.max(), 'Stream')
+
+        # output channels to microphone
+        output_mapping = output_mapping - 1
+        nh = self.h.shape[-1]
+        nfft = scipy.fft.next_fast_len(nt + nh - 1, real=True)
+        X = scipy.fft.rfft(data.T, n=nfft, axis=-1)
+        H = scipy.fft.rfft(self.h[0, output_mapping], n=nfft, axis=-1)
+        mic = scipy.fft.irfft(np.sum(H * X, axis=0), n=nfft)
+        mic = np.concatenate((np.zeros(self.latency), mic))[:nt]
+        if self.noise_level:
+            mic += self.noise_level * self.rng.standard_normal(nt)
+
+        # lost blocks
+        self.status = FakeCallbackFlags()
+        for start in range(0, nt, self.blocksize):
+            if self.rng.random() < self.xrun_probability:
+                self.status.input_overflow = True
+                mic[start:start + self.blocksize] = 0
+
+        rec = np.zeros((nt, len(input_mapping)), dtype=np.float32)
+        rec[:, input_mapping == self.in_ch] = mic[:, None]
+
+        if self.realtime:
+            time.sleep(nt / samplerate)
+
+        return rec
+
+    def Stream(self, callback, channels=None, blocksize=None, samplerate=None, finished_callback=None, **kwargs):
+        """Duplex callback stream, like `sounddevice.Stream`."""
+        if channels is None:
+            channels = (self.max_input_channels, self.max_output_channels)
+        channels = tuple(int(c) for c in np.broadcast_to(channels, 2))
+        self._check_channels(*channels, 'Stream')
+        return FakeStream(
+            self.h, samplerate or self.default.samplerate, blocksize or self.blocksize, callback,
+            finished_callback=finished_callback, realtime=self.realtime, noise_level=self.noise_level,
+            latency=self.latency, xrun_probability=self.xrun_probability, input_channels=[self.in_ch],
+            channels=channels, seed=int(self.rng.integers(2**31)),
+        )